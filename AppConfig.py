@@ -1,5 +1,7 @@
 import logging
+import os
 import tomllib
+import httppool
 import utils
 from aiohttp_retry import ExponentialRetry
 
@@ -20,6 +22,10 @@ class AppConfig:
     def __init__(self):
         # load default values
         self.sleep_timer: int = 10
+        # number of movies/shows checked at the same time
+        self.concurrency: int = 1
+        # default max requests in flight per tracker. override per tracker with max_concurrent in [[trackers]]
+        self.tracker_concurrency: int | None = None
         self.radarr: dict = {
             # scan radarr. using command line --radarr or --sonarr will override this value
             "enabled": True,
@@ -37,17 +43,102 @@ class AppConfig:
             "api_key": "",
             # sonarr port typically 8989, local DNS should work if you have it setup, else "localhost" if local machine
             "url": "http://localhost:8989",
-            "api_suffix": "/api/v3/series"
+            "api_suffix": "/api/v3/series",
+            # shows whose episodes are fetched ahead of the tracker checks
+            "prefetch": 8
         }
 
+        # every configured instance. [radarr]/[sonarr] tables or [[radarr]]/[[sonarr]] arrays.
+        # radarr/sonarr above hold the first instance and the enabled switch
+        self.radarr_instances: list[dict] = [dict(self.radarr, name="radarr")]
+        self.sonarr_instances: list[dict] = [dict(self.sonarr, name="sonarr")]
+        # (media id, season, resolution, type) -> instance that checked it. only filled with several instances
+        self.checked_items: dict = {}
+
         self.log_files: dict = {
             "output_path": "logs/",
             "script_log": "script.log",
             "not_found_radarr": "radarr-not_found.txt",
             "not_found_sonarr": "sonarr-not_found.txt",
             "trump_radarr": "radarr-trump.csv",
-            "trump_sonarr": "sonarr-trump.csv"
+            "trump_sonarr": "sonarr-trump.csv",
+            # one json line per item and tracker plus a run summary. empty disables
+            "results_jsonl": ""
+        }
+
+        self.cache: dict = {
+            # store tracker search results between runs
+            "enabled": True,
+            # defaults to <output_path>/cache
+            "path": "",
+            # days before a cached result is searched again
+            "ttl_found_days": 30,
+            "ttl_not_found_days": 3,
+            "ttl_trump_days": 7
+        }
+        # ResultCache opened by main once configs are merged
+        self.result_cache = None
+        # ParseCache for guessit results. stored under the cache path when the cache is enabled
+        self.parse_cache = None
+
+        self.parsing: dict = {
+            # guessit worker processes. 0 parses on the event loop. defaults to cpu count - 1, at most 4
+            "workers": max(0, min(4, (os.cpu_count() or 1) - 1)),
+            # names sent to a worker at once
+            "batch_size": 32,
+            # names parsed inline before the workers are started. small runs never start them
+            "inline_below": 50
+        }
+        # parsepool.ParsePool created by main when workers is above 0
+        self.parse_pool = None
+
+        self.incremental: dict = {
+            # only check movies/seasons with file changes since the last run. --incremental also enables it
+            "enabled": False,
+            # defaults to <cache path>/scan_state.json
+            "state_file": "",
+            # run a full sweep when the last one is older than this many days. 0 disables
+            "full_sweep_days": 7
         }
+        # ScanState loaded by main when incremental mode is on
+        self.scan_state = None
+
+        # --resume. result files are appended to instead of truncated
+        self.resume: bool = False
+        # checkpoint.Checkpoint of the items finished in this scan. created by main, not used with --serve
+        self.checkpoint = None
+
+        # connection pool settings. see httppool.HTTP_DEFAULTS
+        self.http: dict = dict(httppool.HTTP_DEFAULTS)
+
+        # resultsink.JsonlSink opened by main when log_files results_jsonl or --results-jsonl is set
+        self.results_sink = None
+
+        self.metrics: dict = {
+            # collect request, retry, cache and queue metrics. --metrics-port/--metrics-textfile also enable it
+            "enabled": False,
+            # prometheus textfile rewritten every interval_seconds and at the end of the run. empty disables
+            "textfile": "",
+            "interval_seconds": 15,
+            # serve http://host:port/metrics while the scan runs. 0 disables
+            "host": "127.0.0.1",
+            "port": 0
+        }
+        # metrics.Metrics created by main when metrics are enabled
+        self.run_metrics = None
+
+        self.serve: dict = {
+            # --serve webhook server. point radarr/sonarr connect -> webhook at http://host:port/<instance name>
+            "host": "127.0.0.1",
+            "port": 8787,
+            # webhook password set in radarr/sonarr. empty accepts any request
+            "password": "",
+            # seconds to wait for more imports of the same movie/series before checking it
+            "delay_seconds": 5
+        }
+
+        # logs.OutputWriter set up with logging. writes log records and result files off the event loop
+        self.output_writer = None
 
         # list of trackers to search
         self.trackers: list[TrackerBase] = []
@@ -67,6 +158,14 @@ class AppConfig:
             max_timeout=40.0,  # Maximum delay between retries
             statuses={429, 500, 502, 503, 504}  # Retry on common server errors
         )
+        # trackers leave 429 to their rate limiter so Retry-After pauses every request to the tracker
+        self.tracker_retry_options: ExponentialRetry = ExponentialRetry(
+            attempts=4,
+            start_timeout=5.0,
+            factor=2.0,
+            max_timeout=40.0,
+            statuses={500, 502, 503, 504}
+        )
 
     # def create_config_file(self, config_file: str):
     #     logger.info(f"Creating config template: {config_file}")
@@ -100,16 +199,20 @@ class AppConfig:
         logger.info(f"Loaded config file: {config_file}")
         logger.debug(f"config data: {config_data}")
         self.sleep_timer = config_data.get("sleep_timer", 10)
+        self.concurrency = config_data.get("concurrency", 1)
+        self.tracker_concurrency = config_data.get("tracker_concurrency", None)
 
-        self.radarr["enabled"] = config_data.get("radarr").get("enabled", True)
-        self.radarr["api_key"] = config_data.get("radarr").get("api_key", "")
-        self.radarr["url"] = config_data.get("radarr").get("url", "http://localhost:7878")
-        self.radarr["api_suffix"] = config_data.get("radarr").get("api_suffix", "/api/v3/movie")
+        self.radarr_instances = self.load_arr_instances(config_data.get("radarr"), "radarr", {
+            "url": "http://localhost:7878", "api_suffix": "/api/v3/movie"
+        })
+        self.radarr.update(self.radarr_instances[0])
+        self.radarr["enabled"] = any(instance["enabled"] for instance in self.radarr_instances)
 
-        self.sonarr["enabled"] = config_data.get("sonarr").get("enabled", True)
-        self.sonarr["api_key"] = config_data.get("sonarr").get("api_key", "")
-        self.sonarr["url"] = config_data.get("sonarr").get("url", "http://localhost:8989")
-        self.sonarr["api_suffix"] = config_data.get("sonarr").get("api_suffix", "/api/v3/series")
+        self.sonarr_instances = self.load_arr_instances(config_data.get("sonarr"), "sonarr", {
+            "url": "http://localhost:8989", "api_suffix": "/api/v3/series", "prefetch": 8
+        })
+        self.sonarr.update(self.sonarr_instances[0])
+        self.sonarr["enabled"] = any(instance["enabled"] for instance in self.sonarr_instances)
 
         self.log_files["output_path"] = config_data.get("log_files").get("output_path", "logs/")
         self.log_files["script_log"] = config_data.get("log_files").get("script_log", "script.log")
@@ -117,11 +220,74 @@ class AppConfig:
         self.log_files["not_found_sonarr"] = config_data.get("log_files").get("not_found_sonarr", "sonarr-not_found.txt")
         self.log_files["trump_radarr"] = config_data.get("log_files").get("trump_radarr", "radarr-trump.csv")
         self.log_files["trump_sonarr"] = config_data.get("log_files").get("trump_sonarr", "sonarr-trump.csv")
+        self.log_files["results_jsonl"] = config_data.get("log_files").get("results_jsonl", "")
+
+        cache_configs = config_data.get("cache", {})
+        self.cache["enabled"] = cache_configs.get("enabled", True)
+        self.cache["path"] = cache_configs.get("path", "")
+        self.cache["ttl_found_days"] = cache_configs.get("ttl_found_days", 30)
+        self.cache["ttl_not_found_days"] = cache_configs.get("ttl_not_found_days", 3)
+        self.cache["ttl_trump_days"] = cache_configs.get("ttl_trump_days", 7)
+
+        parsing_configs = config_data.get("parsing", {})
+        self.parsing["workers"] = parsing_configs.get("workers", self.parsing["workers"])
+        self.parsing["batch_size"] = parsing_configs.get("batch_size", 32)
+        self.parsing["inline_below"] = parsing_configs.get("inline_below", 50)
+
+        incremental_configs = config_data.get("incremental", {})
+        self.incremental["enabled"] = incremental_configs.get("enabled", False)
+        self.incremental["state_file"] = incremental_configs.get("state_file", "")
+        self.incremental["full_sweep_days"] = incremental_configs.get("full_sweep_days", 7)
+
+        self.http = httppool.http_settings(config_data.get("http", {}))
+
+        metrics_configs = config_data.get("metrics", {})
+        self.metrics["enabled"] = metrics_configs.get("enabled", False)
+        self.metrics["textfile"] = metrics_configs.get("textfile", "")
+        self.metrics["interval_seconds"] = metrics_configs.get("interval_seconds", 15)
+        self.metrics["host"] = metrics_configs.get("host", "127.0.0.1")
+        self.metrics["port"] = metrics_configs.get("port", 0)
+
+        serve_configs = config_data.get("serve", {})
+        self.serve["host"] = serve_configs.get("host", "127.0.0.1")
+        self.serve["port"] = serve_configs.get("port", 8787)
+        self.serve["password"] = serve_configs.get("password", "")
+        self.serve["delay_seconds"] = serve_configs.get("delay_seconds", 5)
 
         # store the tracker data from configs but don't laod yet. Wait till after merge in command line args
         trackers_list = config_data.get("trackers", [])
         self.tracker_configs = trackers_list
 
+    def load_arr_instances(self, arr_configs, arr, defaults):
+        # a single table or an array of tables. names default to radarr/sonarr, then radarr-2, radarr-3...
+        if not isinstance(arr_configs, list):
+            arr_configs = [arr_configs or {}]
+        instances = []
+        for index, instance_configs in enumerate(arr_configs):
+            instance = {
+                "name": instance_configs.get("name", arr if index == 0 else f"{arr}-{index + 1}"),
+                "enabled": instance_configs.get("enabled", True),
+                "api_key": instance_configs.get("api_key", ""),
+            }
+            for key, default in defaults.items():
+                instance[key] = instance_configs.get(key, default)
+            instances.append(instance)
+        if len({instance["name"] for instance in instances}) != len(instances):
+            raise ValidationError(f"Duplicate {arr} instance names.")
+        return instances
+
+    def claim_item(self, key, instance, instances):
+        # first instance to check an item owns it. returns the owner when another instance got there first
+        if len(instances) < 2:
+            return None
+        owner = self.checked_items.setdefault(key, instance)
+        return owner if owner != instance else None
+
+    def get_cache_path(self):
+        if self.cache.get("path"):
+            return os.path.expanduser(self.cache["path"])
+        return os.path.join(os.path.expanduser(self.log_files.get("output_path") or ""), "cache")
+
     def load_trackers(self):
         trackers_list = self.tracker_configs
         if len(trackers_list) > 0:
@@ -0,0 +1,24 @@
+"""
+Runs main.py for run.py. ru_maxrss survives fork and exec, so a child forked straight from the
+benchmark process would report the mock servers' library as its own peak RSS. This process stays
+small and does the forking instead. Reads one JSON [cmd, cwd, console path] per line and answers
+with [exit code, wall seconds, peak rss bytes].
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+for line in sys.stdin:
+    cmd, cwd, console_path = json.loads(line)
+    started = time.perf_counter()
+    with open(console_path, "w", encoding="utf-8") as console:
+        process = subprocess.Popen(cmd, cwd=cwd, stdout=console, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - started
+    # already reaped by wait4. stops Popen waiting on it again
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is KiB on linux and bytes on macOS
+    peak_rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    print(json.dumps([process.returncode, wall, peak_rss]), flush=True)
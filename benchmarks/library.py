@@ -0,0 +1,155 @@
+import random
+
+# radarr quality shapes: (source, modifier, resolution, quality name)
+MOVIE_QUALITIES = [
+    ("bluray", "remux", 2160, "Remux-2160p"),
+    ("bluray", "remux", 1080, "Remux-1080p"),
+    ("bluray", "none", 1080, "Bluray-1080p"),
+    ("bluray", "none", 720, "Bluray-720p"),
+    ("webdl", "none", 2160, "WEBDL-2160p"),
+    ("webdl", "none", 1080, "WEBDL-1080p"),
+    ("webrip", "none", 1080, "WEBRip-1080p"),
+    ("dvd", "none", 480, "DVD"),
+    ("tv", "none", 720, "HDTV-720p"),
+]
+# sonarr quality shapes: (source, resolution, quality name)
+EPISODE_QUALITIES = [
+    ("web", 1080, "WEBDL-1080p"),
+    ("web", 2160, "WEBDL-2160p"),
+    ("webRip", 1080, "WEBRip-1080p"),
+    ("bluray", 1080, "Bluray-1080p"),
+    ("television", 720, "HDTV-720p"),
+]
+GROUPS = ["NTb", "FLUX", "CMRG", "FraMeSToR", "EPSiLON", "SiC", "playWEB", "HONE", "FGT", "YIFY", ""]
+GUESSIT_SOURCE = {"bluray": "BluRay", "webdl": "WEB-DL", "webrip": "WEBRip", "dvd": "DVD", "tv": "HDTV",
+                  "web": "WEB-DL", "webRip": "WEBRip", "television": "HDTV"}
+
+
+class SyntheticLibrary:
+    """
+    Deterministic fake Radarr/Sonarr library. Same seed and sizes give the same items so
+    runs of a scenario are comparable. Series get a realistic spread of seasons, episode
+    counts, specials and incomplete seasons.
+    """
+
+    def __init__(self, movies=1000, series=100, seed=1):
+        self.seed = seed
+        self.movie_count = movies
+        self.series_count = series
+        rng = random.Random(seed)
+        # per series: list of (season number, episode count, episodes with files)
+        self.series_shapes = []
+        for i in range(series):
+            seasons = []
+            for season_number in range(0 if rng.random() < 0.4 else 1, rng.choice([1, 1, 2, 3, 4, 5, 6, 8, 10, 15]) + 1):
+                episodes = rng.choice([6, 8, 10, 12, 13, 22, 24]) if season_number else rng.randint(1, 5)
+                have = episodes if rng.random() < 0.85 else rng.randint(0, episodes - 1)
+                seasons.append((season_number, episodes, have))
+            self.series_shapes.append(seasons)
+
+    def movie(self, i):
+        rng = random.Random(self.seed * 1_000_003 + i)
+        source, modifier, resolution, name = rng.choice(MOVIE_QUALITIES)
+        group = rng.choice(GROUPS)
+        title = f"Synthetic Movie {i}"
+        year = 1950 + i % 75
+        release = f"{title.replace(" ", ".")}.{year}.{resolution}p.{GUESSIT_SOURCE[source]}{".REMUX" if modifier == "remux" else ""}.x264{f"-{group}" if group else ""}"
+        movie = {
+            "id": i + 1,
+            "title": title,
+            "year": year,
+            "tmdbId": 100000 + i,
+            "imdbId": f"tt{9000000 + i}",
+            "hasFile": rng.random() < 0.95,
+            "overview": "A synthetic movie used for benchmarking. " * 4,
+            "images": [{"coverType": "poster", "url": f"/MediaCover/{i + 1}/poster.jpg", "remoteUrl": f"https://image.tmdb.org/t/p/original/{i}.jpg"}],
+            "genres": ["Drama", "Action"],
+            "alternateTitles": [{"title": f"{title} Alt {n}", "sourceType": "tmdb"} for n in range(2)],
+        }
+        if movie["hasFile"]:
+            movie["movieFile"] = {
+                "id": 500000 + i,
+                "movieId": i + 1,
+                "relativePath": f"{release}.mkv",
+                "path": f"/movies/{title} ({year})/{release}.mkv",
+                "sceneName": release if rng.random() < 0.7 else None,
+                "releaseGroup": group,
+                "size": rng.randint(2, 80) * 1024 ** 3,
+                "dateAdded": f"20{10 + i % 15}-01-01T00:00:00Z",
+                "quality": {"quality": {"id": 7, "name": name, "source": source, "modifier": modifier, "resolution": resolution}},
+                "mediaInfo": {"resolution": f"{resolution * 16 // 9}x{resolution}", "videoCodec": "x264"},
+            }
+        return movie
+
+    def movies(self):
+        for i in range(self.movie_count):
+            yield self.movie(i)
+
+    def series(self, i):
+        seasons = []
+        for season_number, episodes, have in self.series_shapes[i]:
+            seasons.append({
+                "seasonNumber": season_number,
+                "monitored": season_number > 0,
+                "statistics": {
+                    "episodeFileCount": have,
+                    "episodeCount": episodes,
+                    "totalEpisodeCount": episodes,
+                    "sizeOnDisk": have * 1_500_000_000,
+                    "percentOfEpisodes": round(have * 100 / episodes, 1) if episodes else 0,
+                },
+            })
+        return {
+            "id": i + 1,
+            "title": f"Synthetic Show {i}",
+            "year": 1990 + i % 35,
+            "tvdbId": 300000 + i,
+            "tmdbId": 200000 + i,
+            "imdbId": f"tt{8000000 + i}",
+            "overview": "A synthetic series used for benchmarking. " * 4,
+            "images": [{"coverType": "poster", "url": f"/MediaCover/{i + 1}/poster.jpg"}],
+            "seasons": seasons,
+        }
+
+    def all_series(self):
+        for i in range(self.series_count):
+            yield self.series(i)
+
+    def episodes(self, series_id):
+        # sonarr /api/v3/episode?seriesId= with includeEpisodeFile=true
+        i = series_id - 1
+        if i < 0 or i >= self.series_count:
+            return []
+        rng = random.Random(self.seed * 7_000_003 + i)
+        source, resolution, name = rng.choice(EPISODE_QUALITIES)
+        group = rng.choice(GROUPS)
+        episodes = []
+        for season_number, count, have in self.series_shapes[i]:
+            for episode_number in range(1, count + 1):
+                episode = {
+                    "id": series_id * 10000 + season_number * 100 + episode_number,
+                    "seriesId": series_id,
+                    "seasonNumber": season_number,
+                    "episodeNumber": episode_number,
+                    "title": f"Episode {episode_number}",
+                    "hasFile": episode_number <= have,
+                }
+                if episode["hasFile"]:
+                    release = f"Synthetic.Show.{i}.S{season_number:02d}E{episode_number:02d}.{resolution}p.{GUESSIT_SOURCE[source]}.x264{f"-{group}" if group else ""}"
+                    episode["episodeFile"] = {
+                        "id": episode["id"],
+                        "seriesId": series_id,
+                        "seasonNumber": season_number,
+                        "relativePath": f"Season {season_number:02d}/{release}.mkv",
+                        "path": f"/tv/Synthetic Show {i}/Season {season_number:02d}/{release}.mkv",
+                        "releaseGroup": group,
+                        "size": rng.randint(1, 6) * 1024 ** 3,
+                        "dateAdded": "2024-01-01T00:00:00Z",
+                        "quality": {"quality": {"id": 3, "name": name, "source": source, "resolution": resolution}},
+                    }
+                episodes.append(episode)
+        return episodes
+
+    def tracker_hits(self, media_id):
+        # what a tracker has for an item: nothing, a release from a banned group or a normal one
+        return ("none", "banned", "exists")[media_id % 3]
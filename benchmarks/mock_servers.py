@@ -0,0 +1,180 @@
+import asyncio
+import json
+import random
+import socket
+from collections import Counter
+
+from aiohttp import web
+
+from library import SyntheticLibrary
+
+
+class Faults:
+    """
+    Latency and failure injection for one mock server.
+
+    Args:
+        latency (float): mean seconds added to each request.
+        jitter (float): +/- seconds of uniform noise on the latency.
+        error_rate (float): share of requests answered with a 500.
+        rate_limit_rate (float): share of requests answered with a 429.
+        retry_after (int): Retry-After seconds sent with injected 429s.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+
+    async def apply(self):
+        # None to answer normally, else the error response to send
+        delay = self.latency + self.rng.uniform(-self.jitter, self.jitter) if self.jitter else self.latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            return web.json_response({"message": "Too Many Attempts."}, status=429, headers={"Retry-After": str(self.retry_after)})
+        if roll < self.rate_limit_rate + self.error_rate:
+            return web.json_response({"message": "Server Error"}, status=500)
+        return None
+
+
+class MockServer:
+    """
+    One stand-in service on its own localhost port. Counts requests by endpoint and status.
+    """
+
+    def __init__(self, name, faults=None):
+        self.name = name
+        self.faults = faults or Faults()
+        self.requests = Counter()
+        self.app = web.Application(middlewares=[self._middleware])
+        self.runner = None
+        self.port = None
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        endpoint = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        response = await self.faults.apply()
+        if response is None:
+            response = await handler(request)
+        self.requests[(endpoint, response.status)] += 1
+        return response
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.SockSite(self.runner, sock).start()
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def total_requests(self):
+        return sum(self.requests.values())
+
+
+def _json_array(items):
+    # library lists are served pre-encoded like a real arr would stream them
+    return ("[" + ",".join(json.dumps(item) for item in items) + "]").encode()
+
+
+class RadarrServer(MockServer):
+    def __init__(self, library: SyntheticLibrary, faults=None):
+        super().__init__("radarr", faults)
+        self.library = library
+        self.body = _json_array(library.movies())
+        self.app.router.add_get("/api/v3/movie", self.movies)
+        # single movie lookups made by --serve webhook checks
+        self.app.router.add_get("/api/v3/movie/{id}", self.movie)
+
+    async def movies(self, request):
+        return web.Response(body=self.body, content_type="application/json")
+
+    async def movie(self, request):
+        movie_id = int(request.match_info["id"])
+        if not 1 <= movie_id <= self.library.movie_count:
+            return web.json_response({"message": "NotFound"}, status=404)
+        return web.json_response(self.library.movie(movie_id - 1))
+
+
+class SonarrServer(MockServer):
+    def __init__(self, library: SyntheticLibrary, faults=None):
+        super().__init__("sonarr", faults)
+        self.library = library
+        self.body = _json_array(library.all_series())
+        self.app.router.add_get("/api/v3/series", self.series)
+        self.app.router.add_get("/api/v3/series/{id}", self.one_series)
+        self.app.router.add_get("/api/v3/episode", self.episodes)
+
+    async def series(self, request):
+        return web.Response(body=self.body, content_type="application/json")
+
+    async def one_series(self, request):
+        series_id = int(request.match_info["id"])
+        if not 1 <= series_id <= self.library.series_count:
+            return web.json_response({"message": "NotFound"}, status=404)
+        return web.json_response(self.library.series(series_id - 1))
+
+    async def episodes(self, request):
+        return web.json_response(self.library.episodes(int(request.query.get("seriesId", 0))))
+
+
+def _torrent_name(library, media_id, resolution, season=None):
+    hit = library.tracker_hits(media_id)
+    if hit == "none":
+        return None
+    group = "FGT" if hit == "banned" else "NTb"
+    season = f"S{season:02d}." if season else ""
+    return f"Synthetic.{media_id}.{season}{resolution or 1080}p.BluRay.x264-{group}"
+
+
+class AitherServer(MockServer):
+    BANNED_GROUPS = ["FGT", "YIFY", "EVO", "aXXo"]
+
+    def __init__(self, library: SyntheticLibrary, faults=None):
+        super().__init__("aither", faults)
+        self.library = library
+        self.app.router.add_get("/api/torrents/filter", self.filter)
+        self.app.router.add_get("/api/blacklists/releasegroups", self.blacklist)
+
+    async def filter(self, request):
+        media_id = int(request.query.get("tmdbId") or request.query.get("tvdbId") or 0)
+        season = request.query.get("seasonNumber")
+        data = []
+        name = _torrent_name(self.library, media_id, None, int(season) if season else None)
+        if media_id and name:
+            data.append({"type": "torrent", "attributes": {"name": name, "tmdb_id": media_id}})
+        return web.json_response({"data": data, "links": {"next": None}, "meta": {"per_page": 25}},
+                                 headers={"X-RateLimit-Limit": "60", "X-RateLimit-Remaining": "59"})
+
+    async def blacklist(self, request):
+        if request.headers.get("If-None-Match") == '"bench"':
+            return web.Response(status=304)
+        return web.json_response({"data": [{"name": group} for group in self.BANNED_GROUPS]}, headers={"ETag": '"bench"'})
+
+
+class BhdServer(MockServer):
+    def __init__(self, library: SyntheticLibrary, faults=None):
+        super().__init__("bhd", faults)
+        self.library = library
+        self.app.router.add_post("/api/torrents/{api_key}", self.search)
+
+    async def search(self, request):
+        # tmdb_id=movie%2F123 or tv%2F123
+        tmdb_id = request.query.get("tmdb_id", "")
+        media_id = int(tmdb_id.rsplit("/", 1)[-1]) if tmdb_id else 0
+        search = request.query.get("search", "")
+        name = _torrent_name(self.library, media_id, None, int(search[1:]) if search.startswith("S") else None)
+        return web.json_response({"status_code": 1, "results": [{"name": name}] if media_id and name else []})
@@ -0,0 +1,173 @@
+"""
+End to end benchmark. Starts local stand-ins for Radarr, Sonarr, AITHER and BHD serving a
+synthetic library, runs main.py against them and reports items/sec, peak RSS and request
+counts per scenario. Nothing leaves localhost.
+
+    python benchmarks/run.py
+    python benchmarks/run.py --scenario flaky --scenario large --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+
+from library import SyntheticLibrary
+from mock_servers import Faults, RadarrServer, SonarrServer, AitherServer, BhdServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# arr/tracker values are Faults arguments
+SCENARIOS = {
+    "baseline": {"movies": 1000, "series": 100, "arr": {"latency": 0.002}, "tracker": {"latency": 0.02, "jitter": 0.01}},
+    "slow-trackers": {"movies": 1000, "series": 100, "arr": {"latency": 0.002}, "tracker": {"latency": 0.25, "jitter": 0.15}},
+    "flaky": {"movies": 1000, "series": 100, "arr": {"latency": 0.002},
+              "tracker": {"latency": 0.02, "jitter": 0.01, "error_rate": 0.01, "rate_limit_rate": 0.005}},
+    "large": {"movies": 10000, "series": 1000, "arr": {"latency": 0.002}, "tracker": {"latency": 0.02, "jitter": 0.01}},
+    "huge": {"movies": 50000, "series": 5000, "arr": {"latency": 0.002}, "tracker": {"latency": 0.02, "jitter": 0.01}},
+}
+
+
+def write_config(path, servers, output_path, requests_per_minute):
+    radarr, sonarr, aither, bhd = servers
+    config = f"""sleep_timer = 0
+
+[cache]
+enabled = false
+
+[radarr]
+api_key = "bench"
+url = "{radarr.url}"
+
+[sonarr]
+api_key = "bench"
+url = "{sonarr.url}"
+
+[log_files]
+output_path = "{output_path}"
+
+[[trackers]]
+name = "AITHER"
+api_key = "bench"
+url = "{aither.url}"
+requests_per_minute = {requests_per_minute}
+
+[[trackers]]
+name = "BHD"
+api_key = "bench"
+url = "{bhd.url}"
+requests_per_minute = {requests_per_minute}
+"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(config)
+
+
+def start_launcher():
+    # must start before any library is built so its own peak stays below main.py's
+    return subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "launcher.py")],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+
+
+def run_main(launcher, config_path, log_path, concurrency, extra_args):
+    # returns (exit code, wall seconds, peak rss bytes) of a main.py run
+    cmd = [sys.executable, os.path.join(REPO_ROOT, "main.py"), "--config-path", config_path,
+           "--log-path", log_path, "--concurrency", str(concurrency), *extra_args]
+    launcher.stdin.write(json.dumps([cmd, REPO_ROOT, os.path.join(log_path, "console.txt")]) + "\n")
+    launcher.stdin.flush()
+    return tuple(json.loads(launcher.stdout.readline()))
+
+
+async def run_scenario(launcher, name, scenario, args):
+    library = SyntheticLibrary(scenario["movies"], scenario["series"], args.seed)
+    arr_faults = scenario.get("arr", {})
+    tracker_faults = scenario.get("tracker", {})
+    servers = [
+        RadarrServer(library, Faults(**arr_faults, seed=args.seed)),
+        SonarrServer(library, Faults(**arr_faults, seed=args.seed + 1)),
+        AitherServer(library, Faults(**tracker_faults, seed=args.seed + 2)),
+        BhdServer(library, Faults(**tracker_faults, seed=args.seed + 3)),
+    ]
+    for server in servers:
+        await server.start()
+    try:
+        with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as work_dir:
+            log_path = os.path.join(work_dir, "logs")
+            os.makedirs(log_path)
+            write_config(os.path.join(work_dir, "config.toml"), servers, log_path, args.requests_per_minute)
+            returncode, wall, peak_rss = await asyncio.to_thread(
+                run_main, launcher, work_dir, log_path, args.concurrency, shlex.split(args.main_args)
+            )
+            if returncode != 0:
+                with open(os.path.join(log_path, "console.txt"), encoding="utf-8") as f:
+                    tail = f.read()[-2000:]
+                print(f"[{name}] main.py exited with {returncode}:\n{tail}", file=sys.stderr)
+    finally:
+        for server in servers:
+            await server.stop()
+
+    items = scenario["movies"] + scenario["series"]
+    return {
+        "scenario": name,
+        "movies": scenario["movies"],
+        "series": scenario["series"],
+        "concurrency": args.concurrency,
+        "exit_code": returncode,
+        "wall_seconds": round(wall, 3),
+        "items_per_second": round(items / wall, 2) if wall else None,
+        "peak_rss_mb": round(peak_rss / 1024 ** 2, 1),
+        "requests": {
+            server.name: {f"{endpoint} {status}": count for (endpoint, status), count in sorted(server.requests.items())}
+            for server in servers
+        },
+        "request_totals": {server.name: server.total_requests() for server in servers},
+    }
+
+
+def print_report(results):
+    print(f"{"Scenario":<16} {"Items":>8} {"Wall s":>9} {"Items/s":>9} {"Peak RSS MB":>12} {"Requests":>9}")
+    for result in results:
+        items = result["movies"] + result["series"]
+        print(f"{result["scenario"]:<16} {items:>8} {result["wall_seconds"]:>9.2f} {result["items_per_second"]:>9.1f} "
+              f"{result["peak_rss_mb"]:>12.1f} {sum(result["request_totals"].values()):>9}")
+    for result in results:
+        print(f"\n{result["scenario"]} requests:")
+        for server, endpoints in result["requests"].items():
+            for endpoint, count in endpoints.items():
+                print(f"  {server:<8} {endpoint:<40} {count:>8}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark main.py against local mock Arr and tracker servers")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Scenario to run. Repeat for several. Default baseline")
+    parser.add_argument("--movies", type=int, default=None, help="Override the scenario movie count")
+    parser.add_argument("--series", type=int, default=None, help="Override the scenario series count")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="main.py --concurrency")
+    parser.add_argument("--requests-per-minute", type=int, default=0, help="Tracker rate limit. 0 is unlimited")
+    parser.add_argument("--main-args", default="", help="Extra arguments passed to main.py, e.g. \"--catalog\"")
+    parser.add_argument("--seed", type=int, default=1, help="Synthetic library seed")
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    launcher = start_launcher()
+    results = []
+    for name in args.scenario or ["baseline"]:
+        scenario = dict(SCENARIOS[name])
+        if args.movies is not None:
+            scenario["movies"] = args.movies
+        if args.series is not None:
+            scenario["series"] = args.series
+        results.append(await run_scenario(launcher, name, scenario, args))
+    launcher.stdin.close()
+    launcher.wait()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
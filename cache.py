@@ -0,0 +1,87 @@
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger("customLogger")
+
+DAY = 24 * 60 * 60
+
+
+def query_key(category, media_id, season_number=None, resolutions=None, video_type=None):
+    # normalized tracker query. order of resolutions doesn't matter to the tracker so sort them.
+    # a single type name (BHD get_types) is one value, not a list of characters
+    if isinstance(resolutions, (str, int)):
+        resolutions = [resolutions]
+    resolutions = ",".join(sorted(str(res) for res in (resolutions or [])))
+    return f"{category}:{media_id}:{season_number or ''}:{resolutions}:{video_type or ''}"
+
+
+def file_key(item):
+    # local file identity. an upgrade or replaced file changes path or size so the entry misses
+    return f"{item.path or ""}|{item.size or ""}"
+
+
+class ResultCache:
+    """
+    Tracker search results stored in a local sqlite db so unchanged items
+    are not searched again until their entry expires.
+    """
+
+    # commit after this many writes. rest is committed on close
+    COMMIT_EVERY = 50
+
+    def __init__(self, path, ttl_found_days=30, ttl_not_found_days=3, ttl_trump_days=7):
+        self.path = path
+        self.ttls = {
+            "exists": ttl_found_days * DAY,
+            "not_found": ttl_not_found_days * DAY,
+            "trump": ttl_trump_days * DAY,
+        }
+        # when bypassed results are still stored, just never read
+        self.bypass = False
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " tracker TEXT NOT NULL, query TEXT NOT NULL, file TEXT NOT NULL,"
+            " status TEXT NOT NULL, torrent TEXT, release_group TEXT, checked REAL NOT NULL,"
+            " PRIMARY KEY (tracker, query, file))"
+        )
+        self.conn.commit()
+
+    def get(self, tracker, query, file):
+        if self.bypass:
+            return None
+        row = self.conn.execute(
+            "SELECT status, torrent, release_group, checked FROM results WHERE tracker=? AND query=? AND file=?",
+            (tracker, query, file)
+        ).fetchone()
+        if row is None or time.time() - row[3] > self.ttls.get(row[0], 0):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"status": row[0], "torrent": row[1], "group": row[2]}
+
+    def put(self, tracker, query, file, result):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results (tracker, query, file, status, torrent, release_group, checked)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (tracker, query, file, result["status"], result.get("torrent"), result.get("group"), time.time())
+        )
+        self._writes += 1
+        if self._writes % self.COMMIT_EVERY == 0:
+            self.conn.commit()
+
+    def purge(self):
+        self.conn.execute("DELETE FROM results")
+        self.conn.commit()
+        logger.info(f"Purged result cache: {self.path}")
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
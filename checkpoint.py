@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger("customLogger")
+
+
+def item_key(item):
+    # movies by radarr id, seasons by sonarr series id and season number
+    season_number = getattr(item, "season_number", None)
+    if season_number is not None:
+        return season_key(item.arr_id, season_number)
+    return str(item.arr_id)
+
+
+def season_key(series_id, season_number):
+    return f"{series_id}:{season_number}"
+
+
+class Checkpoint:
+    """
+    Items each tracker finished checking in the current scan, per Arr instance. Saved as the
+    scan goes so --resume can skip work already done after a crash, a restart or Ctrl+C.
+    Searches that failed are not recorded and run again on resume. An Arr whose scan completes
+    is recorded as finished instead of its entries so a resume skips it, and the file is
+    removed once the whole scan is done.
+    """
+
+    # save every this many finished (item, tracker) checks
+    SAVE_EVERY = 50
+
+    def __init__(self, path, resume=False, writer=None):
+        self.path = path
+        # logs.OutputWriter. saves are queued behind the result writes they cover
+        self.writer = writer
+        # "arr/instance/tracker" -> item keys
+        self.completed = {}
+        # arrs whose scan finished. skipped by --resume
+        self.finished = set()
+        self.resumed = False
+        self._changes = 0
+        if resume:
+            if os.path.exists(path):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    self.completed = {key: set(items) for key, items in data.get("completed", {}).items()}
+                    self.finished = set(data.get("finished", []))
+                    self.resumed = True
+                    logger.info(f"Resume: skipping {sum(len(items) for items in self.completed.values())} finished checks.")
+                except (OSError, ValueError) as e:
+                    logger.error(f"Error reading checkpoint {path}: {e}. Starting from the beginning.")
+            else:
+                logger.info("Resume: no checkpoint found. Starting from the beginning.")
+
+    def _key(self, arr, instance, tracker):
+        return f"{arr}/{instance or arr}/{tracker.__class__.__name__}"
+
+    def pending(self, arr, item, trackers):
+        # trackers that still have to check the item
+        key = item_key(item)
+        return [tracker for tracker in trackers if key not in self.completed.get(self._key(arr, item.instance, tracker), ())]
+
+    def season_pending(self, show, season_number, trackers) -> bool:
+        # whether a tracker still has to check a sonarr season. known before its episodes are fetched
+        instance = (show.get("instance") or {}).get("name")
+        key = season_key(show.get("id"), season_number)
+        return any(key not in self.completed.get(self._key("sonarr", instance, tracker), ()) for tracker in trackers)
+
+    def mark(self, arr, item, tracker):
+        self.completed.setdefault(self._key(arr, item.instance, tracker), set()).add(item_key(item))
+        self._changes += 1
+        if self._changes % self.SAVE_EVERY == 0:
+            self.save()
+
+    def complete(self, arr):
+        # the arr's scan finished. its item keys aren't needed, a resume skips the whole arr
+        self.completed = {key: items for key, items in self.completed.items() if not key.startswith(f"{arr}/")}
+        self.finished.add(arr)
+        self.save()
+
+    def is_complete(self, arr) -> bool:
+        return arr in self.finished
+
+    def clear(self):
+        # the whole scan finished. nothing to resume
+        self.completed = {}
+        self.finished = set()
+        self.save()
+
+    def save(self):
+        if self.completed or self.finished:
+            text = json.dumps({
+                "finished": sorted(self.finished),
+                "completed": {key: sorted(items) for key, items in self.completed.items()},
+            })
+        else:
+            text = None
+        if self.writer is None:
+            self._write(text)
+        else:
+            self.writer.write(self._write, text)
+
+    def _write(self, text):
+        # result files are flushed first so a saved check is never missing from them
+        if self.writer is not None:
+            self.writer.flush()
+        if text is None:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
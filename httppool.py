@@ -0,0 +1,113 @@
+import logging
+
+import aiohttp
+from aiohttp_retry import RetryClient
+
+logger = logging.getLogger("customLogger")
+
+# connector and timeout settings for one pool. [http] in the config, per tracker overrides via http = {...}
+HTTP_DEFAULTS = {
+    # max open connections for the pool and per host. 0 is unlimited
+    "limit": 100,
+    "limit_per_host": 0,
+    # reuse connections between requests and close them after this many idle seconds
+    "keepalive": True,
+    "keepalive_timeout": 30,
+    # seconds resolved hosts are cached. 0 disables the dns cache
+    "ttl_dns_cache": 300,
+    # seconds. 0 means no timeout
+    "connect_timeout": 10,
+    "read_timeout": 60,
+    "total_timeout": 0,
+}
+
+
+def http_settings(base, overrides=None):
+    return {**HTTP_DEFAULTS, **(base or {}), **(overrides or {})}
+
+
+class PoolStats:
+    """
+    Connection counts for one session collected through an aiohttp TraceConfig.
+    Logged at debug level on exit to help tune the [http] settings.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.connector = None
+        self.requests = 0
+        self.created = 0
+        self.reused = 0
+
+    def trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        return trace_config
+
+    async def _on_request_start(self, session, context, params):
+        self.requests += 1
+
+    async def _on_connection_create_end(self, session, context, params):
+        self.created += 1
+
+    async def _on_connection_reuseconn(self, session, context, params):
+        self.reused += 1
+
+    def open_connections(self):
+        # idle keep-alive connections plus the ones in use
+        connector = self.connector
+        if connector is None or connector.closed:
+            return 0
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        return idle + len(getattr(connector, "_acquired", ()))
+
+    def reuse_ratio(self):
+        connections = self.created + self.reused
+        return self.reused / connections if connections else 0.0
+
+    def log(self):
+        logger.debug(
+            f"HTTP pool [{self.name}]: {self.requests} requests, {self.created} connections opened, "
+            f"{self.reused} reused ({self.reuse_ratio():.0%}), {self.open_connections()} open"
+        )
+
+
+def log_stats(pool_stats):
+    for stats in pool_stats:
+        stats.log()
+
+
+def create_session(name, settings, retry_options, metrics=None):
+    """
+    RetryClient with its own connection pool so a slow host can't hold connections another host needs.
+
+    Returns:
+        (RetryClient, PoolStats)
+    """
+    settings = http_settings(settings)
+    stats = PoolStats(name)
+    connector_args = {
+        "limit": settings["limit"],
+        "limit_per_host": settings["limit_per_host"],
+        "use_dns_cache": bool(settings["ttl_dns_cache"]),
+        "ttl_dns_cache": settings["ttl_dns_cache"] or None,
+    }
+    if settings["keepalive"]:
+        connector_args["keepalive_timeout"] = settings["keepalive_timeout"]
+    else:
+        connector_args["force_close"] = True
+    stats.connector = aiohttp.TCPConnector(**connector_args)
+    timeout = aiohttp.ClientTimeout(
+        total=settings["total_timeout"] or None,
+        connect=settings["connect_timeout"] or None,
+        sock_read=settings["read_timeout"] or None,
+    )
+    session = RetryClient(
+        retry_options=retry_options,
+        connector=stats.connector,
+        timeout=timeout,
+        trace_configs=[stats.trace_config()] + ([metrics.trace_config(name)] if metrics is not None else []),
+    )
+    return session, stats
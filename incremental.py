@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger("customLogger")
+
+DAY = 24 * 60 * 60
+
+
+def file_fingerprint(item):
+    return {"dateAdded": item.date_added, "quality": item.quality_name}
+
+
+def instance_key(instance, key):
+    # items from extra radarr/sonarr instances are namespaced. the default instance keeps plain ids
+    if instance and instance not in ("radarr", "sonarr"):
+        return f"{instance}:{key}"
+    return str(key)
+
+
+def season_fingerprint(season):
+    # sonarr season statistics change whenever an episode file is added, removed or upgraded
+    statistics = season.get("statistics") or {}
+    return f"{statistics.get("episodeFileCount")}:{statistics.get("sizeOnDisk")}"
+
+
+class ScanState:
+    """
+    Remembers which movie files and seasons were already checked so an
+    incremental run only sends new or changed items to the trackers.
+    """
+
+    # save every this many changes so an interrupted run keeps most of its progress
+    SAVE_EVERY = 100
+
+    def __init__(self, path, full_sweep_days=0, force_full=False):
+        self.path = path
+        self.movies = {}
+        self.seasons = {}
+        self.last_full_sweep = 0
+        self._changes = 0
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.movies = data.get("movies", {})
+                self.seasons = data.get("seasons", {})
+                self.last_full_sweep = data.get("last_full_sweep", 0)
+            except (OSError, ValueError) as e:
+                logger.error(f"Error reading scan state {path}: {e}. Running full scan.")
+
+        # do a full sweep if forced, on first run or when the last one is too old
+        self.full_sweep = force_full or self.last_full_sweep == 0 or (
+            full_sweep_days and time.time() - self.last_full_sweep > full_sweep_days * DAY
+        )
+        self.started = time.time()
+        if self.full_sweep:
+            logger.info("Incremental: running full sweep.")
+
+    def movie_changed(self, movie) -> bool:
+        if self.full_sweep:
+            return True
+        if not movie.has_file:
+            return False
+        return self.movies.get(instance_key(movie.instance, movie.file_id)) != file_fingerprint(movie)
+
+    def mark_movie(self, movie):
+        if movie.has_file:
+            self.movies[instance_key(movie.instance, movie.file_id)] = file_fingerprint(movie)
+            self._changed()
+
+    def season_changed(self, show, season) -> bool:
+        if self.full_sweep:
+            return True
+        stored = self.seasons.get(self._season_key(show, season))
+        return stored is None or stored.get("statistics") != season_fingerprint(season)
+
+    def _season_key(self, show, season):
+        return instance_key((show.get("instance") or {}).get("name"), f"{show["id"]}:{season["seasonNumber"]}")
+
+    def show_changed(self, show) -> bool:
+        # only complete seasons get checked so only they can make a show worth scanning again
+        return any(
+            self.season_changed(show, season) for season in show.get("seasons", [])
+            if season["seasonNumber"] > 0 and (season.get("statistics") or {}).get("percentOfEpisodes") == 100
+        )
+
+    def mark_season(self, show, season, season_item):
+        self.seasons[self._season_key(show, season)] = {
+            "statistics": season_fingerprint(season),
+            "episodeFileId": season_item.file_id,
+            **file_fingerprint(season_item),
+        }
+        self._changed()
+
+    def _changed(self):
+        self._changes += 1
+        if self._changes % self.SAVE_EVERY == 0:
+            self.save()
+
+    def save(self, completed=False):
+        if completed and self.full_sweep:
+            self.last_full_sweep = self.started
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"last_full_sweep": self.last_full_sweep, "movies": self.movies, "seasons": self.seasons}, f)
+        os.replace(tmp_path, self.path)
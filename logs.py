@@ -1,10 +1,20 @@
+import atexit
 import logging
 import os
+import queue
+import time
+import traceback
+from logging.handlers import QueueHandler, QueueListener
+import profiling
 from AppConfig import AppConfig
+from scheduler import ItemBufferFilter
 
 
 # Just to same line the logs while logging to file also
 class NoNewlineStreamHandler(logging.StreamHandler):
+    # set while OutputWriter owns the handler. it flushes in batches instead of every record
+    batched = False
+
     def emit(self, record):
         try:
             msg = self.format(record)
@@ -13,11 +23,14 @@ class NoNewlineStreamHandler(logging.StreamHandler):
                 stream.write(msg)
             else:
                 stream.write(msg + "\n")
-            self.flush()
+            if not self.batched:
+                self.flush()
         except Exception:
             self.handleError(record)
 
 class CustomFileHandlerNewLines(logging.FileHandler):
+    batched = False
+
     def emit(self, record):
         try:
             msg = self.format(record)
@@ -29,14 +42,89 @@ class CustomFileHandlerNewLines(logging.FileHandler):
                 if len(parts) == 2:  # If there's only one delimiter, it means the second one doesn't exist
                     msg = parts[1]
                 stream.write(msg + "\n")
-            self.flush()
+            if not self.batched:
+                self.flush()
         except Exception:
             self.handleError(record)
 
+class OutputWriter(QueueListener):
+    """
+    Background thread for log output and result file writes. The event loop only queues
+    records and writes. They are handled in queued order so partial console lines
+    ("... ") still join up, and streams are flushed once the queue runs dry or every
+    FLUSH_INTERVAL seconds while it stays busy, instead of after every line.
+    """
+
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, logger, *handlers):
+        super().__init__(queue.SimpleQueue(), *handlers, respect_handler_level=True)
+        self.logger = logger
+        self.queue_handler = QueueHandler(self.queue)
+        self.files = []
+        self._last_flush = time.monotonic()
+        self._closed = False
+
+    def start(self):
+        for handler in self.handlers:
+            handler.batched = True
+            self.logger.removeHandler(handler)
+        self.logger.addHandler(self.queue_handler)
+        super().start()
+        # flush whatever is queued even if main never gets to close it
+        atexit.register(self.close)
+
+    def add_file(self, out_file):
+        # result files written through write(). flushed and closed with the writer
+        self.files.append(out_file)
+
+    def write(self, func, *args):
+        if self._closed:
+            func(*args)
+        else:
+            self.queue.put_nowait((func, args))
+
+    def handle(self, record):
+        if isinstance(record, tuple):
+            func, args = record
+            try:
+                with profiling.phase("result writing"):
+                    func(*args)
+            except Exception:
+                traceback.print_exc()
+        else:
+            super().handle(record)
+        if self.queue.empty() or time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        for stream in (*self.handlers, *self.files):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        # drain the queue, flush and hand the handlers back to the logger for anything logged after
+        if self._closed:
+            return
+        self._closed = True
+        self.stop()
+        self.flush()
+        for out_file in self.files:
+            out_file.close()
+        self.logger.removeHandler(self.queue_handler)
+        for handler in self.handlers:
+            handler.batched = False
+            self.logger.addHandler(handler)
+
 def setup_logging(app_configs: AppConfig):
     # Setup logging
     logger = logging.getLogger("customLogger")
     logger.setLevel(logging.INFO)
+    # buffer records from concurrent item checks so they print in order
+    logger.addFilter(ItemBufferFilter())
 
     # Console handler with a simpler format
     console_handler = NoNewlineStreamHandler()
@@ -47,6 +135,7 @@ def setup_logging(app_configs: AppConfig):
     # File handler with detailed format
     output_path = app_configs.log_files.get("output_path")
     if output_path:
+        os.makedirs(os.path.expanduser(output_path), exist_ok=True)
         script_log = os.path.join(os.path.expanduser(output_path), app_configs.log_files["script_log"])
     else:
         script_log = os.path.join(os.path.expanduser(app_configs.log_files["script_log"]))
@@ -54,3 +143,8 @@ def setup_logging(app_configs: AppConfig):
     file_formatter = logging.Formatter("%(message)s")
     file_handler.setFormatter(file_formatter)
     logger.addHandler(file_handler)
+
+    # console and file output move to a background thread along with the tracker result files.
+    # those are opened on their first write and added to the writer then
+    app_configs.output_writer = OutputWriter(logger, console_handler, file_handler)
+    app_configs.output_writer.start()
@@ -1,27 +1,127 @@
+# first so --startup-timing can time every import after it
+import startup
 import os
+import json
 import sys
 import asyncio
 import tomllib
 from os.path import basename
-import time
 import argparse
-from aiohttp_retry import RetryClient
+from functools import partial
+import contextlib
+import httppool
+import profiling
 import sonarr
 import radarr
+import scheduler
+import shards
 import logging
+from cache import ResultCache
+from parsecache import ParseCache
+from resultsink import JsonlSink
+from incremental import ScanState
+from checkpoint import Checkpoint
+from models import MediaItem
 
 from AppConfig import AppConfig, ValidationError
 from logs import setup_logging
 
 logger = logging.getLogger("customLogger")
+startup.mark("imports")
 
 # Setup function to prompt user for missing API keys and URLs if critical for the selected mode(s)
 def setup(app_configs: AppConfig):
-    # Alert the user about missing non-critical variables
-    if not app_configs.radarr['enabled'] and (not app_configs.radarr['api_key'] or not app_configs.radarr['url']):
-        raise ValidationError("Radarr API key or URL is missing.")
-    if not app_configs.sonarr["enabled"] and (not app_configs.sonarr['api_key'] or not app_configs.sonarr['url']):
-        raise ValidationError("Sonarr API key or URL is missing. Sonarr functionality will be limited.")
+    # every enabled instance of the arrs selected for this run needs an API key and URL
+    for arr, instances in (("Radarr", app_configs.radarr_instances), ("Sonarr", app_configs.sonarr_instances)):
+        if not getattr(app_configs, arr.lower())["enabled"]:
+            continue
+        for instance in instances:
+            if instance["enabled"] and (not instance['api_key'] or not instance['url']):
+                raise ValidationError(f"{arr} API key or URL is missing for instance {instance['name']}.")
+
+def progress(index, library: scheduler.ReadAhead):
+    # total is known once the library has finished downloading. until then the size of the last run
+    if library.total is not None:
+        return f"[{index + 1}/{library.total}]"
+    return f"[{index + 1}/{f"~{library.expected}" if library.expected else "?"}]"
+
+# library sizes of the last full scan. the read ahead is bounded so the real total is only known at the end
+def load_library_count(configs: AppConfig, arr):
+    try:
+        with open(os.path.join(configs.get_cache_path(), "library_counts.json"), "r", encoding="utf-8") as f:
+            return json.load(f).get(arr)
+    except (OSError, ValueError):
+        return None
+
+def save_library_count(configs: AppConfig, arr, count):
+    path = os.path.join(configs.get_cache_path(), "library_counts.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            counts = json.load(f)
+    except (OSError, ValueError):
+        counts = {}
+    counts[arr] = count
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(counts, f)
+
+async def check_movie(session, configs: AppConfig, movies, index, movie: MediaItem):
+    if movie.has_file:
+        logger.debug(
+            f"Source: {basename(movie.filename)}"
+        )
+    logger.info(f"{progress(index, movies)} Checking {movie.title}: ")
+
+    # same movie at the same resolution and type in another radarr instance is only checked once
+    owner = radarr.claim_movie(movie, configs) if movie.has_file else None
+    # trackers that haven't finished the movie before a --resume
+    trackers = configs.checkpoint.pending("radarr", movie, configs.trackers) if configs.checkpoint is not None else configs.trackers
+    if not movie.has_file:
+        logger.info(
+            f"SKIPPED. missing local file"
+        )
+    elif owner is not None:
+        logger.info(
+            f"SKIPPED. already checked in {owner}"
+        )
+        if configs.scan_state is not None:
+            configs.scan_state.mark_movie(movie)
+    elif not trackers:
+        logger.info(
+            "SKIPPED. checked before resume"
+        )
+    else :
+        # a movie with a failed search stays changed for the next incremental run
+        if await radarr.process_movie(session, movie, trackers) and configs.scan_state is not None:
+            configs.scan_state.mark_movie(movie)
+    if configs.run_metrics is not None:
+        configs.run_metrics.inc("items_total", {"arr": "radarr"})
+
+async def check_show(session, configs: AppConfig, shows, index, prefetched):
+    show, episodes_by_season = prefetched
+    logger.info(f"{progress(index, shows)} Checking {show["title"]}:")
+    await sonarr.process_show(session, show, configs.trackers, configs, episodes_by_season)
+    if configs.run_metrics is not None:
+        configs.run_metrics.inc("items_total", {"arr": "sonarr"})
+
+def merge_shards(configs: AppConfig, shards_path, results_jsonl=None):
+    try:
+        merged, missing = shards.merge(configs, shards_path, results_jsonl)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Error merging shards: {e}")
+    for path, count in merged:
+        print(f"Merged {count} shard files into {path}")
+    if missing:
+        print(f"Warning: no output from shard {", ".join(str(index) for index in missing)}. Merged files are incomplete.")
+
+async def prepare_tracker(tracker):
+    await tracker.refresh_banned_groups(tracker.session)
+    if tracker.catalog_enabled:
+        try:
+            await tracker.ensure_catalog(tracker.session)
+        except Exception as e:
+            logger.error(f"[{tracker.__class__.__name__}] Catalog sync failed, using search api: {e}")
+            tracker.catalog_enabled = False
 
 async def main():
     parser = argparse.ArgumentParser(
@@ -30,11 +130,37 @@ async def main():
     parser.add_argument("--radarr", action="store_true", help="Check Radarr library")
     parser.add_argument("--sonarr", action="store_true", help="Check Sonarr library")
     parser.add_argument("--log-path", required=False, default="logs/", help="Output file path")
-    parser.add_argument("-s", "--sleep-timer", type=int, required=False, default=None, help="Sleep time between calls")
+    parser.add_argument("-s", "--sleep-timer", type=int, required=False, default=None, help="Default seconds between calls per tracker when requests_per_minute is not set")
+    parser.add_argument("-c", "--concurrency", type=int, required=False, default=None, help="Number of movies/shows checked at the same time")
+    parser.add_argument("--tracker-concurrency", type=int, required=False, default=None, help="Max requests in flight per tracker")
+    parser.add_argument("--no-cache", action="store_true", default=False, help="Ignore cached tracker results and search again")
+    parser.add_argument("--purge-cache", action="store_true", default=False, help="Delete all cached tracker results before running")
+    parser.add_argument("--parse-workers", type=int, required=False, default=None, help="guessit worker processes. 0 parses inline")
+    parser.add_argument("--incremental", action="store_true", default=False, help="Only check items with file changes since the last run")
+    parser.add_argument("--full-sweep", action="store_true", default=False, help="With --incremental, check everything and refresh the saved state")
+    parser.add_argument("--resume", action="store_true", default=False, help="Continue an interrupted scan. Skips items already checked and appends to the output files")
+    parser.add_argument("--catalog", action="store_true", default=False, help="Answer searches from a local snapshot of each tracker's catalog where supported")
+    parser.add_argument("--results-jsonl", required=False, default=None, help="Write one json line per item and tracker checked to this file")
+    parser.add_argument("--metrics-port", type=int, required=False, default=None, help="Serve prometheus metrics on this port while the scan runs")
+    parser.add_argument("--metrics-textfile", required=False, default=None, help="Write prometheus metrics to this file during and after the run")
+    parser.add_argument("--profile", action="store_true", default=False, help="Print wall/CPU time per phase at exit")
+    parser.add_argument("--profile-output", required=False, default=None, help="With --profile, also write cProfile stats to this file")
+    parser.add_argument("--serve", action="store_true", default=False, help="Run a webhook server and check movies/shows as radarr/sonarr import them instead of scanning the libraries")
+    parser.add_argument("--serve-port", type=int, required=False, default=None, help="With --serve, port to listen on")
+    parser.add_argument("--shard", type=shards.parse_shard, required=False, default=None, help="Only check slice i of N (e.g. 2/4) of the libraries. Output goes to <log-path>/shards/shard-i-of-N")
+    parser.add_argument("--startup-timing", action="store_true", default=False, help="Print time per startup step and import time per module before checking")
     parser.add_argument("--debug", action="store_true", default=False, help="Enable debug logs")
     parser.add_argument("--config-path", required=False, default="config/", help="Config file path")
 
+    subparsers = parser.add_subparsers(dest="command")
+    merge_parser = subparsers.add_parser("merge", help="Combine the output of --shard runs into <log-path>/<TRACKER>/")
+    merge_parser.add_argument("--shards-path", required=False, default=None, help="Directory with the shard-i-of-N outputs. Defaults to <log-path>/shards")
+
     args = parser.parse_args()
+    if args.shard is not None and args.serve:
+        parser.error("--shard can't be used with --serve")
+    if args.profile:
+        profiling.PROFILER.enable(cprofile=args.profile_output is not None)
     # merge in config file with command line parms. should probably switch to ChainMap instead of mess below
     # env_vars = {k.lower().replace('app_', ''): v for k, v in os.environ.items() if k.startswith('APP_')}
     # config = ChainMap(args, env_vars, defaults)
@@ -43,24 +169,101 @@ async def main():
     config_file = os.path.join(args.config_path, 'config.toml')
     try:
         configs.load_config_file(config_file)
+        startup.mark("config")
 
         if args.log_path:
             configs.log_files["output_path"] = args.log_path
 
+        if args.command == "merge":
+            merge_shards(configs, args.shards_path or os.path.join(configs.log_files["output_path"], "shards"), args.results_jsonl)
+            return
+        if args.shard is not None:
+            shards.apply_shard(configs, args.shard, os.path.join(configs.log_files["output_path"], "shards"), args.results_jsonl)
+
         configs.radarr["enabled"] = args.radarr or (not args.sonarr and not args.radarr)
         configs.sonarr["enabled"] = args.sonarr or (not args.sonarr and not args.radarr)
 
         if args.sleep_timer is not None:
-            configs.SLEEP_TIMER = args.sleep_timer
+            configs.sleep_timer = args.sleep_timer
+        if args.concurrency is not None:
+            configs.concurrency = args.concurrency
+
+        configs.resume = args.resume and not args.serve
 
         # load tracker objects after merge in args and env values
         configs.load_trackers()
+        startup.mark("trackers")
+        for tracker in configs.trackers:
+            if args.tracker_concurrency is not None:
+                tracker.max_concurrent = args.tracker_concurrency
+            if args.catalog:
+                tracker.catalog_enabled = True
+            if tracker.catalog_enabled and not tracker.supports_catalog():
+                tracker.catalog_enabled = False
 
         setup_logging(configs)
+        startup.mark("logging")
         if args.debug:
             logger.setLevel(logging.DEBUG)
 
         setup(app_configs=configs)  # Ensure API keys and URLs are set
+        if args.shard is not None:
+            logger.info(f"Shard {args.shard[0]}/{args.shard[1]}: output in {configs.log_files["output_path"]}")
+
+        # a shard's --results-jsonl is in its shard directory. see apply_shard
+        if args.results_jsonl and args.shard is None:
+            configs.results_sink = JsonlSink(args.results_jsonl, configs.output_writer, configs.resume)
+        elif configs.log_files["results_jsonl"]:
+            results_jsonl = os.path.join(os.path.expanduser(configs.log_files["output_path"] or ""), configs.log_files["results_jsonl"])
+            configs.results_sink = JsonlSink(results_jsonl, configs.output_writer, configs.resume)
+
+        # progress of the scan for --resume. a webhook server has nothing to resume
+        if not args.serve:
+            configs.checkpoint = Checkpoint(os.path.join(configs.get_cache_path(), "checkpoint.json"), configs.resume, configs.output_writer)
+
+        if configs.cache["enabled"]:
+            configs.result_cache = ResultCache(
+                os.path.join(configs.get_cache_path(), "results.db"),
+                configs.cache["ttl_found_days"],
+                configs.cache["ttl_not_found_days"],
+                configs.cache["ttl_trump_days"]
+            )
+            configs.result_cache.bypass = args.no_cache
+            if args.purge_cache:
+                configs.result_cache.purge()
+            configs.parse_cache = ParseCache(os.path.join(configs.get_cache_path(), "parsed.db"))
+        else:
+            configs.parse_cache = ParseCache()
+        if args.parse_workers is not None:
+            configs.parsing["workers"] = args.parse_workers
+        if configs.parsing["workers"] > 0:
+            # only loaded when used, like metrics and the webhook server below
+            from parsepool import ParsePool
+            configs.parse_pool = ParsePool(configs.parsing["workers"], configs.parsing["batch_size"], configs.parsing["inline_below"])
+            configs.parse_cache.pool = configs.parse_pool
+
+        if args.metrics_port is not None:
+            configs.metrics["port"] = args.metrics_port
+        if args.metrics_textfile:
+            configs.metrics["textfile"] = args.metrics_textfile
+        if configs.metrics["enabled"] or configs.metrics["port"] or configs.metrics["textfile"]:
+            from metrics import Metrics
+            configs.run_metrics = Metrics()
+            if configs.result_cache is not None:
+                configs.run_metrics.watch_cache("results", configs.result_cache)
+            configs.run_metrics.watch_cache("parse", configs.parse_cache)
+            configs.run_metrics.collect("items_per_second", configs.run_metrics.items_per_second)
+
+        if args.serve_port is not None:
+            configs.serve["port"] = args.serve_port
+
+        if args.incremental or configs.incremental["enabled"]:
+            state_file = configs.incremental["state_file"] or os.path.join(configs.get_cache_path(), "scan_state.json")
+            configs.scan_state = ScanState(state_file, configs.incremental["full_sweep_days"], args.full_sweep)
+            # only changed items are checked. add to the files of earlier runs unless everything is checked again
+            if not configs.scan_state.full_sweep:
+                for tracker in configs.trackers:
+                    tracker.output_mode = "a"
     except FileNotFoundError:
         # logger.error(f"Error config file not found: {config_file}")
         sys.exit(
@@ -77,41 +280,122 @@ async def main():
     #     logger.info("No arguments specified. Running both Radarr and Sonarr checks.\n")
 
     try:
-        async with RetryClient(retry_options=configs.http_retry_options) as session:
-            if args.radarr or (not args.sonarr and not args.radarr):
-                movies = await radarr.get_all_movies(session, configs)
-                total = len(movies)
-                for index, movie in enumerate(movies):
-                    # if index < 3474:  continue  #DEBUG: skip entries to problem area
-                    if "movieFile" in movie:
-                        filename = movie.get("movieFile").get("relativePath")
-                        if "sceneName" in movie.get("movieFile"):
-                            filename = movie.get("movieFile").get("sceneName")
-                        logger.debug(
-                            f"Source: {basename(filename)}"
-                        )
-                    logger.info(f"[{index + 1}/{total}] Checking {movie["title"]}: ")
-
-                    if not "movieFile" in movie:
-                        logger.info(
-                            f"SKIPPED. missing local file"
-                        )
-                    else :
-                        await radarr.process_movie(session, movie, configs.trackers)
-                        time.sleep(configs.sleep_timer)  # Respectful delay
-
-            if args.sonarr or (not args.sonarr and not args.radarr):
-                shows = await sonarr.get_all_shows(session, configs)
-                total = len(shows)
-                for index, show in enumerate(shows):
-                    # if index < 874:  continue  #DEBUG: skip entries to problem area
-                    logger.info(f"[{index + 1}/{total}] Checking {show["title"]}:")
-                    await sonarr.process_show(session, show, configs.trackers, configs)
-                    time.sleep(configs.sleep_timer)  # Respectful delay
+        async with contextlib.AsyncExitStack() as pools:
+            # radarr and sonarr get a pool each and every tracker its own
+            pool_stats = []
+            arr_sessions = {}
+            for arr in ("radarr", "sonarr"):
+                arr_sessions[arr], stats = httppool.create_session(arr, configs.http, configs.http_retry_options, configs.run_metrics)
+                await pools.enter_async_context(arr_sessions[arr])
+                pool_stats.append(stats)
+            for tracker in configs.trackers:
+                tracker.session, tracker.pool_stats = httppool.create_session(
+                    tracker.__class__.__name__, tracker.http_settings or configs.http, configs.tracker_retry_options, configs.run_metrics
+                )
+                await pools.enter_async_context(tracker.session)
+                pool_stats.append(tracker.pool_stats)
+            # runs before the sessions close so open connections are still counted
+            pools.callback(httppool.log_stats, pool_stats)
+
+            if configs.run_metrics is not None:
+                await configs.run_metrics.start(
+                    configs.metrics["textfile"], configs.metrics["host"], configs.metrics["port"], configs.metrics["interval_seconds"]
+                )
+                pools.push_async_callback(configs.run_metrics.stop)
+
+            # fetch blacklists and sync catalog snapshots up front so the first checks don't wait on them.
+            # every tracker at the same time
+            await asyncio.gather(*(prepare_tracker(tracker) for tracker in configs.trackers))
+            startup.mark("blacklists and catalogs")
+            if startup.ENABLED:
+                logger.info(f"\nStartup:\n{startup.report()}\n")
+
+            if args.serve:
+                import webhook
+                server = webhook.WebhookServer(configs, arr_sessions)
+                if configs.run_metrics is not None:
+                    configs.run_metrics.watch_queue("webhook", server)
+                await server.serve()
+
+            scans = {arr: not args.serve and (getattr(args, arr) or (not args.sonarr and not args.radarr)) for arr in ("radarr", "sonarr")}
+            # an arr that finished before the interruption already has all its lines in the output files
+            for arr in scans:
+                if scans[arr] and configs.checkpoint.is_complete(arr):
+                    logger.info(f"Resume: {arr} scan finished before the interruption. Skipping it.")
+                    scans[arr] = False
+            library_read_ahead = max(1, configs.concurrency) * 8
+            if scans["radarr"]:
+                session = arr_sessions["radarr"]
+                movies = radarr.get_movies(session, configs)
+                if args.shard is not None:
+                    movies = (movie async for movie in movies if shards.movie_in_shard(movie, args.shard))
+                if configs.scan_state is not None:
+                    logger.info("Incremental: checking new or changed movies only.")
+                    movies = (movie async for movie in movies if configs.scan_state.movie_changed(movie))
+                # a few items ahead of the checks. the rest waits in the stream
+                movies = scheduler.ReadAhead(movies, library_read_ahead, None if configs.scan_state else load_library_count(configs, "radarr"))
+                if configs.run_metrics is not None:
+                    configs.run_metrics.watch_queue("radarr_library", movies)
+                await scheduler.run_ordered(movies, partial(check_movie, session, configs, movies), configs.concurrency)
+                configs.checkpoint.complete("radarr")
+                if configs.scan_state is None:
+                    save_library_count(configs, "radarr", movies.total)
+
+            if scans["sonarr"]:
+                session = arr_sessions["sonarr"]
+                shows = sonarr.get_shows(session, configs)
+                if args.shard is not None:
+                    shows = (show async for show in shows if shards.show_in_shard(show, args.shard))
+                if configs.scan_state is not None:
+                    logger.info("Incremental: checking new or changed shows only.")
+                    shows = (show async for show in shows if configs.scan_state.show_changed(show))
+                shows = scheduler.ReadAhead(shows, library_read_ahead, None if configs.scan_state else load_library_count(configs, "sonarr"))
+                # episodes for the next few shows are fetched while the trackers are searched
+                prefetched = scheduler.ReadAhead(sonarr.prefetch_episodes(session, shows, configs), configs.sonarr["prefetch"])
+                if configs.run_metrics is not None:
+                    configs.run_metrics.watch_queue("sonarr_library", shows)
+                    configs.run_metrics.watch_queue("sonarr_prefetch", prefetched)
+                await scheduler.run_ordered(prefetched, partial(check_show, session, configs, shows), configs.concurrency)
+                configs.checkpoint.complete("sonarr")
+                if configs.scan_state is None:
+                    save_library_count(configs, "sonarr", shows.total)
+            if configs.checkpoint is not None:
+                configs.checkpoint.clear()
+
+            if configs.scan_state is not None:
+                configs.scan_state.save(completed=True)
     except Exception as e:
         sys.exit(f"Error: {e}")
     except KeyboardInterrupt:
         logger.info("\nProcess interrupted by user. Exiting.\n")
+    finally:
+        if configs.scan_state is not None:
+            configs.scan_state.save()
+        if configs.checkpoint is not None:
+            configs.checkpoint.save()
+        if configs.result_cache is not None:
+            logger.debug(f"Result cache: {configs.result_cache.hits} hits, {configs.result_cache.misses} misses")
+            configs.result_cache.close()
+        if configs.parse_pool is not None:
+            logger.debug(f"Parse pool: {configs.parse_pool.batches} batches")
+            configs.parse_pool.close()
+        if configs.parse_cache is not None:
+            logger.debug(f"Parse cache: {configs.parse_cache.hits} hits, {configs.parse_cache.misses} parsed")
+            configs.parse_cache.close()
+        for tracker in configs.trackers:
+            if tracker.coalesced:
+                logger.debug(f"[{tracker.__class__.__name__}] {tracker.coalesced} searches shared an identical request")
+            tracker.finish_output()
+        if configs.results_sink is not None:
+            configs.results_sink.close()
+        if profiling.PROFILER.enabled:
+            logger.info(f"\nProfile:\n{profiling.PROFILER.report()}")
+            if args.profile_output:
+                profiling.PROFILER.dump(args.profile_output)
+                logger.info(f"cProfile stats written to {args.profile_output}")
+        # flush queued log lines and result files
+        if configs.output_writer is not None:
+            configs.output_writer.close()
 
 
 if __name__ == "__main__":
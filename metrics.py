@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger("customLogger")
+
+PREFIX = "exists_check"
+# seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+    """
+    Counters, latency histograms and gauges for a scan, rendered in the Prometheus text
+    format. HTTP calls are counted through a TraceConfig added to every pool, gauges are
+    read from callbacks when the metrics are exported.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        # (name, labels) -> (kind, callback)
+        self.collectors = {}
+        self.help = {
+            "http_requests_total": "HTTP requests by service and response status",
+            "http_request_duration_seconds": "HTTP request latency by service",
+            "http_retries_total": "HTTP requests retried by http_retry_options",
+            "tracker_requests_coalesced_total": "Tracker searches answered by an identical request already in flight",
+            "items_total": "Library items checked",
+            "webhooks_total": "Webhooks received in --serve mode by instance and event",
+            "items_per_second": "Library items checked per second since the run started",
+            "cache_hits_total": "Cache hits by cache",
+            "cache_misses_total": "Cache misses by cache",
+            "cache_hit_ratio": "Cache hits over lookups by cache",
+            "queue_depth": "Items waiting in a pipeline queue",
+        }
+        self.textfile = None
+        self._runner = None
+        self._exporter = None
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, labels=None, value=1):
+        self.counters[(name, _labels(labels))] += value
+
+    def observe(self, name, value, labels=None):
+        key = (name, _labels(labels))
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    def collect(self, name, callback, labels=None, kind="gauge"):
+        # value read from callback() whenever the metrics are rendered
+        self.collectors[(name, _labels(labels))] = (kind, callback)
+
+    def watch_cache(self, name, cache):
+        # ResultCache/ParseCache hit counters
+        labels = {"cache": name}
+        self.collect("cache_hits_total", lambda: cache.hits, labels, "counter")
+        self.collect("cache_misses_total", lambda: cache.misses, labels, "counter")
+        self.collect("cache_hit_ratio", lambda: cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0, labels)
+
+    def watch_queue(self, name, read_ahead):
+        self.collect("queue_depth", read_ahead.queue.qsize, {"queue": name})
+
+    def items_per_second(self):
+        elapsed = time.monotonic() - self.started
+        items = sum(value for (name, labels), value in self.counters.items() if name == "items_total")
+        return items / elapsed if elapsed > 0 else 0.0
+
+    def trace_config(self, service):
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            context.start = time.monotonic()
+            attempt = (context.trace_request_ctx or {}).get("current_attempt", 1)
+            if attempt > 1:
+                self.inc("http_retries_total", {"service": service})
+
+        async def on_request_end(session, context, params):
+            self.inc("http_requests_total", {"service": service, "status": params.response.status})
+            self.observe("http_request_duration_seconds", time.monotonic() - context.start, {"service": service})
+
+        async def on_request_exception(session, context, params):
+            self.inc("http_requests_total", {"service": service, "status": "error"})
+            self.observe("http_request_duration_seconds", time.monotonic() - context.start, {"service": service})
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+    def render(self):
+        families = defaultdict(list)
+        kinds = {}
+        for (name, labels), value in self.counters.items():
+            kinds[name] = "counter"
+            families[name].append(f"{PREFIX}_{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), (kind, callback) in self.collectors.items():
+            try:
+                value = float(callback())
+            except Exception:
+                continue
+            kinds[name] = kind
+            families[name].append(f"{PREFIX}_{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), histogram in self.histograms.items():
+            kinds[name] = "histogram"
+            lines = families[name]
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f"{PREFIX}_{name}_bucket{_format_labels(labels, (("le", f"{bound:g}"),))} {count}")
+            lines.append(f"{PREFIX}_{name}_bucket{_format_labels(labels, (("le", "+Inf"),))} {histogram.count}")
+            lines.append(f"{PREFIX}_{name}_sum{_format_labels(labels)} {histogram.sum:g}")
+            lines.append(f"{PREFIX}_{name}_count{_format_labels(labels)} {histogram.count}")
+
+        out = []
+        for name in sorted(families):
+            if name in self.help:
+                out.append(f"# HELP {PREFIX}_{name} {self.help[name]}")
+            out.append(f"# TYPE {PREFIX}_{name} {kinds[name]}")
+            out.extend(families[name])
+        return "\n".join(out) + "\n"
+
+    def write_textfile(self, path):
+        # node_exporter textfile collector reads whole files so write to a temp file and swap it in
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    async def _export_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.write_textfile(self.textfile)
+            except OSError as e:
+                logger.debug(f"Metrics textfile write failed: {e}")
+
+    async def _handle_metrics(self, request):
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self, textfile=None, host="127.0.0.1", port=0, interval=15):
+        # serve /metrics while the scan runs and/or rewrite a textfile every interval seconds
+        if port:
+            app = web.Application()
+            app.router.add_get("/metrics", self._handle_metrics)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, host, port).start()
+            logger.info(f"Metrics: http://{host}:{port}/metrics")
+        if textfile:
+            self.textfile = textfile
+            self._exporter = asyncio.create_task(self._export_loop(interval))
+
+    async def stop(self):
+        if self._exporter is not None:
+            self._exporter.cancel()
+            await asyncio.gather(self._exporter, return_exceptions=True)
+            self._exporter = None
+        if self.textfile:
+            # final numbers for the finished run
+            self.write_textfile(self.textfile)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,96 @@
+import utils
+
+
+class MediaItem:
+    """
+    Fields the tracker checks need from one Radarr movie, pulled out of the Arr json once.
+    The raw dict can be dropped after this so a large library stays small in memory.
+    """
+
+    __slots__ = (
+        "instance", "arr_id", "title", "tmdb_id", "imdb_id",
+        "file_id", "path", "relative_path", "scene_name", "release_group",
+        "source", "modifier", "resolution", "mediainfo_resolution", "quality_name", "date_added", "size",
+    )
+
+    def __init__(self, arr_id=None, title="", tmdb_id=None, imdb_id=None):
+        # name of the radarr/sonarr instance the item came from
+        self.instance = None
+        self.arr_id = arr_id
+        self.title = title
+        self.tmdb_id = tmdb_id
+        self.imdb_id = imdb_id
+        self.file_id = None
+        self.path = None
+        self.relative_path = None
+        self.scene_name = None
+        self.release_group = ""
+        self.source = None
+        self.modifier = None
+        self.resolution = None
+        self.mediainfo_resolution = None
+        self.quality_name = None
+        self.date_added = None
+        self.size = None
+
+    @property
+    def has_file(self) -> bool:
+        return self.file_id is not None
+
+    @property
+    def filename(self):
+        # sceneName is closer to the release name when radarr/sonarr has it
+        return self.scene_name or self.relative_path
+
+    def load_file(self, media_file):
+        # copy the movieFile/episodeFile fields the checks use
+        if not media_file:
+            return self
+        quality_info = (media_file.get("quality") or {}).get("quality") or {}
+        self.file_id = media_file.get("id")
+        self.path = media_file.get("path")
+        self.relative_path = media_file.get("relativePath")
+        self.scene_name = media_file.get("sceneName")
+        self.release_group = (media_file.get("releaseGroup") or "").strip()
+        self.source = quality_info.get("source")
+        self.modifier = quality_info.get("modifier")
+        self.resolution = quality_info.get("resolution")
+        self.quality_name = quality_info.get("name")
+        self.date_added = media_file.get("dateAdded")
+        self.size = media_file.get("size")
+        # dvd quality has no resolution. keep the mediainfo height as a fallback
+        mediainfo_resolution = (media_file.get("mediaInfo") or {}).get("resolution")
+        if mediainfo_resolution and "x" in mediainfo_resolution:
+            self.mediainfo_resolution = mediainfo_resolution.split("x")[1]
+        return self
+
+    @property
+    def video_type(self):
+        # local source/modifier classified the way trackers are searched
+        return utils.get_video_type(self.source, self.modifier)
+
+    @classmethod
+    def from_radarr(cls, movie, instance=None):
+        item = cls(movie.get("id"), movie.get("title", ""), movie.get("tmdbId"), movie.get("imdbId"))
+        item.instance = instance
+        return item.load_file(movie.get("movieFile"))
+
+
+class SeasonItem(MediaItem):
+    """
+    One complete season of a Sonarr series. File fields come from the episode file
+    used to represent the season, assuming a season pack with the same quality throughout.
+    """
+
+    __slots__ = ("tvdb_id", "season_number")
+
+    def __init__(self, arr_id=None, title="", tmdb_id=None, imdb_id=None, tvdb_id=None, season_number=None):
+        super().__init__(arr_id, title, tmdb_id, imdb_id)
+        self.tvdb_id = tvdb_id
+        self.season_number = season_number
+
+    @classmethod
+    def from_sonarr(cls, show, season_number, episode_file):
+        item = cls(show.get("id"), show.get("title", ""), show.get("tmdbId"), show.get("imdbId"), show.get("tvdbId"), season_number)
+        item.instance = (show.get("instance") or {}).get("name")
+        return item.load_file(episode_file)
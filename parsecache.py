@@ -0,0 +1,127 @@
+import asyncio
+import importlib.metadata
+import json
+import logging
+import os
+import sqlite3
+from collections import OrderedDict
+from functools import partial
+
+import profiling
+
+logger = logging.getLogger("customLogger")
+
+# guessit results the checks use. everything else is dropped before caching
+PARSED_FIELDS = ("source", "other", "screen_size", "release_group")
+
+
+@profiling.timed("guessit")
+def parse_name(name):
+    # guessit (with rebulk and babelfish) is slow to import. loaded on the first parse
+    import guessit
+    release_info = guessit.guessit(name)
+    return {field: release_info[field] for field in PARSED_FIELDS if field in release_info}
+
+
+class ParseCache:
+    """
+    guessit results keyed by file/torrent name. Recent names are kept in an in memory
+    LRU and every result is stored in a sqlite db so re-runs over an unchanged library
+    don't parse local files again. The db is cleared when the guessit version changes.
+    """
+
+    # commit after this many new names. rest is committed on close
+    COMMIT_EVERY = 200
+
+    def __init__(self, path=None, maxsize=4096, pool=None):
+        self.path = path
+        self.maxsize = maxsize
+        # parsepool.ParsePool for misses. None parses inline
+        self.pool = pool
+        # name -> parse in progress in the pool
+        self._inflight = {}
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self.conn = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.conn = sqlite3.connect(path)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS parsed (name TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            # installed version from the package metadata. doesn't import guessit
+            guessit_version = importlib.metadata.version("guessit")
+            row = self.conn.execute("SELECT value FROM meta WHERE key='guessit_version'").fetchone()
+            if row is None or row[0] != guessit_version:
+                if row is not None:
+                    logger.debug(f"guessit changed {row[0]} -> {guessit_version}. Clearing parse cache.")
+                self.conn.execute("DELETE FROM parsed")
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('guessit_version', ?)", (guessit_version,))
+            self.conn.commit()
+
+    def _remember(self, name, release_info):
+        self.memory[name] = release_info
+        self.memory.move_to_end(name)
+        if len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def get(self, name):
+        # cached result or None. doesn't parse
+        if name in self.memory:
+            self.memory.move_to_end(name)
+            self.hits += 1
+            return self.memory[name]
+        if self.conn is not None:
+            row = self.conn.execute("SELECT data FROM parsed WHERE name=?", (name,)).fetchone()
+            if row is not None:
+                release_info = json.loads(row[0])
+                self._remember(name, release_info)
+                self.hits += 1
+                return release_info
+        return None
+
+    def put(self, name, release_info):
+        self._remember(name, release_info)
+        if self.conn is not None:
+            self.conn.execute("INSERT OR REPLACE INTO parsed (name, data) VALUES (?, ?)", (name, json.dumps(release_info, default=str)))
+            self._writes += 1
+            if self._writes % self.COMMIT_EVERY == 0:
+                self.conn.commit()
+
+    def parse(self, name):
+        release_info = self.get(name)
+        if release_info is None:
+            self.misses += 1
+            release_info = parse_name(name)
+            self.put(name, release_info)
+        return release_info
+
+    async def parse_async(self, name):
+        # parse() with misses sent to the pool. concurrent requests for a name share one parse
+        release_info = self.get(name)
+        if release_info is not None:
+            return release_info
+        if self.pool is None:
+            return self.parse(name)
+        future = self._inflight.get(name)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(self.pool.parse(name))
+            self._inflight[name] = future
+            future.add_done_callback(partial(self._parsed, name))
+        else:
+            self.hits += 1
+        return await asyncio.shield(future)
+
+    def _parsed(self, name, future):
+        self._inflight.pop(name, None)
+        if not future.cancelled() and future.exception() is None:
+            self.put(name, future.result())
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+import profiling
+from parsecache import parse_name
+
+logger = logging.getLogger("customLogger")
+
+WARMUP_NAME = "Warm.Up.2020.1080p.BluRay.x264-GRP"
+
+
+def _ignore_sigint():
+    # ctrl+c is handled by the main process, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def parse_names(names):
+    # runs in a worker process
+    return [parse_name(name) for name in names]
+
+
+class ParsePool:
+    """
+    guessit in worker processes so parsing a name doesn't stall every other check on the
+    event loop. Names asked for in the same loop iteration go to a worker as one batch to
+    cut down on IPC. The first inline_below names are parsed inline so small runs never
+    start the pool. After that, names are still parsed inline until the workers have
+    started, and always if the pool breaks.
+    """
+
+    def __init__(self, workers, batch_size=32, inline_below=50):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.inline_below = inline_below
+        self.executor = None
+        self.ready = False
+        self.broken = False
+        self.requested = 0
+        self.batches = 0
+        self.batch = []
+        self._flush_handle = None
+
+    def _start(self):
+        # forkserver avoids forking the running output writer thread
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        try:
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_ignore_sigint)
+            warmup = asyncio.wrap_future(self.executor.submit(parse_names, [WARMUP_NAME]))
+        except (OSError, RuntimeError) as e:
+            self._broken(e)
+            return
+        warmup.add_done_callback(self._started)
+
+    def _started(self, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self._broken(future.exception())
+        else:
+            self.ready = True
+            logger.debug(f"Parse pool: {self.workers} workers started")
+
+    def _broken(self, error):
+        if not self.broken:
+            logger.warning(f"Parse pool unavailable, parsing inline: {error}")
+        self.broken = True
+        self.ready = False
+
+    async def parse(self, name):
+        self.requested += 1
+        if self.broken or self.requested <= self.inline_below:
+            return parse_name(name)
+        if self.executor is None:
+            self._start()
+        if not self.ready:
+            return parse_name(name)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.batch.append((name, future))
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_soon(self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self.batch = self.batch, []
+        if not batch:
+            return
+        self.batches += 1
+        started = time.perf_counter()
+        try:
+            job = asyncio.wrap_future(self.executor.submit(parse_names, [name for name, _ in batch]))
+        except (BrokenProcessPool, RuntimeError) as e:
+            self._broken(e)
+            self._parse_inline(batch)
+            return
+        job.add_done_callback(partial(self._deliver, batch, started))
+
+    def _deliver(self, batch, started, job):
+        profiling.record("guessit", time.perf_counter() - started)
+        if job.cancelled():
+            for _, future in batch:
+                future.cancel()
+            return
+        if job.exception() is not None:
+            # a dead worker breaks the pool. a name guessit can't parse only fails this batch
+            if isinstance(job.exception(), BrokenProcessPool):
+                self._broken(job.exception())
+            self._parse_inline(batch)
+            return
+        for (_, future), release_info in zip(batch, job.result()):
+            if not future.done():
+                future.set_result(release_info)
+
+    def _parse_inline(self, batch):
+        for name, future in batch:
+            if future.done():
+                continue
+            try:
+                future.set_result(parse_name(name))
+            except Exception as e:
+                future.set_exception(e)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
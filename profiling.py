@@ -0,0 +1,107 @@
+import contextlib
+import cProfile
+import functools
+import threading
+import time
+
+# phases in the order they are printed. anything else timed is listed after them
+PHASES = (
+    "library download", "json decode", "guessit", "classification", "url build",
+    "rate limit wait", "tracker http", "result cache", "result writing",
+)
+
+
+class Profiler:
+    """
+    Wall and CPU time per phase of a run for --profile. Phases run inside concurrent
+    checks so wall times are summed across tasks and can add up to more than the run.
+    CPU time is only kept for phases that don't await, since the event loop runs other
+    tasks in between.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = {}
+        self.started_wall = 0.0
+        self.started_cpu = 0.0
+        self.cprofile = None
+        # the output writer thread times result writes too
+        self._lock = threading.Lock()
+
+    def enable(self, cprofile=False):
+        self.enabled = True
+        self.started_wall = time.perf_counter()
+        self.started_cpu = time.process_time()
+        if cprofile:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def add(self, name, wall, cpu=None):
+        with self._lock:
+            stats = self.phases.setdefault(name, [0, 0.0, None])
+            stats[0] += 1
+            stats[1] += wall
+            if cpu is not None:
+                stats[2] = (stats[2] or 0.0) + cpu
+
+    @contextlib.contextmanager
+    def _timed_phase(self, name, cpu):
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time() if cpu else None
+        try:
+            yield
+        finally:
+            self.add(
+                name, time.perf_counter() - wall_start,
+                time.thread_time() - cpu_start if cpu else None
+            )
+
+    def phase(self, name, cpu=True):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed_phase(name, cpu)
+
+    def report(self):
+        wall = time.perf_counter() - self.started_wall
+        cpu = time.process_time() - self.started_cpu
+        names = [name for name in PHASES if name in self.phases]
+        names += sorted(name for name in self.phases if name not in PHASES)
+        lines = [f"{"Phase":<18} {"Calls":>8} {"Wall s":>10} {"CPU s":>10}"]
+        for name in names:
+            calls, phase_wall, phase_cpu = self.phases[name]
+            phase_cpu = f"{phase_cpu:.3f}" if phase_cpu is not None else "-"
+            lines.append(f"{name:<18} {calls:>8} {phase_wall:>10.3f} {phase_cpu:>10}")
+        lines.append(f"{"run":<18} {"":>8} {wall:>10.3f} {cpu:>10.3f}")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(path)
+
+
+PROFILER = Profiler()
+
+
+def phase(name, cpu=True):
+    # time a block under name when --profile is on. pass cpu=False for blocks that await
+    return PROFILER.phase(name, cpu)
+
+
+def record(name, wall):
+    # add an already measured wall time
+    if PROFILER.enabled:
+        PROFILER.add(name, wall)
+
+
+def timed(name):
+    # decorator version of phase for plain functions
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with PROFILER.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,26 +1,20 @@
 import asyncio
 import logging
+import scheduler
+import utils
 from AppConfig import AppConfig
+from models import MediaItem
 
 logger = logging.getLogger("customLogger")
 
 
 # might need move this to tracker class
-def get_movie_resolution(movie):
-    # get resolution from radarr if missing try pull from media info
-    try:
-        movie_resolution = movie.get("movieFile").get("quality").get("quality").get("resolution")
-        # if no resolution like with dvd quality. try parse from mediainfo instead
-        if not movie_resolution:
-            mediainfo_resolution = movie.get("movieFile").get("mediaInfo").get("resolution")
-            width, height = mediainfo_resolution.split("x")
-            movie_resolution = height
-    except KeyError:
-        movie_resolution = None
-    return movie_resolution
+def get_movie_resolution(movie: MediaItem):
+    # get resolution from radarr. if missing like with dvd quality use the mediainfo height instead
+    return movie.resolution or movie.mediainfo_resolution
 
 # Function to process each movie
-async def process_movie(session, movie, trackers):
+async def process_movie(session, movie: MediaItem, trackers):
     # add newline to put list below title if multiple checks
     # and tab indent sub items
     indented = False
@@ -29,18 +23,38 @@ async def process_movie(session, movie, trackers):
         indented = True
 
     # display missing release group warning. So only once and not duplicated per tracker.
-    if "releaseGroup" in movie["movieFile"] and not movie["movieFile"]["releaseGroup"].strip():
+    if not movie.release_group:
         logger.warning(
             f"{"\t" if indented else ""}Warning: Release group missing. Banned checks will be skipped."
         )
     tasks = [tracker.search_movie(session, movie, indented) for tracker in trackers]
-    await asyncio.gather(*tasks)
+    # True when every tracker answered
+    return all(await asyncio.gather(*tasks))
 
 
-# Function to get all movies from Radarr
-async def get_all_movies(session, app_configs: AppConfig):
-    radarr_url = app_configs.radarr['url'] + app_configs.radarr['api_suffix']
-    async with session.get(radarr_url, headers={"X-Api-Key": app_configs.radarr['api_key']}) as response:
+# Function to get all movies from Radarr. yields a MediaItem per movie as the response streams in
+async def get_all_movies(session, app_configs: AppConfig, instance=None):
+    instance = instance or app_configs.radarr_instances[0]
+    radarr_url = instance['url'] + instance['api_suffix']
+    async with session.get(radarr_url, headers={"X-Api-Key": instance['api_key']}) as response:
         response.raise_for_status()  # Ensure we handle request errors properly
-        movies = await response.json()
-        return movies
+        async for movie in utils.iter_json_array(response):
+            yield MediaItem.from_radarr(movie, instance["name"])
+
+# one movie by radarr id. used by --serve to load the movie a webhook was sent for
+async def get_movie(session, instance, movie_id):
+    radarr_url = instance['url'] + instance['api_suffix'] + f"/{movie_id}"
+    async with session.get(radarr_url, headers={"X-Api-Key": instance['api_key']}) as response:
+        response.raise_for_status()
+        movie = await response.json()
+    return MediaItem.from_radarr(movie, instance["name"])
+
+# movies from every enabled instance, downloaded at the same time and merged as they arrive
+def get_movies(session, app_configs: AppConfig):
+    instances = [instance for instance in app_configs.radarr_instances if instance["enabled"]]
+    return scheduler.merge(*(get_all_movies(session, app_configs, instance) for instance in instances))
+
+# first instance to reach a movie checks it. same tmdb id, resolution and type elsewhere is skipped
+def claim_movie(movie: MediaItem, app_configs: AppConfig):
+    key = ("movie", movie.tmdb_id, get_movie_resolution(movie), movie.video_type)
+    return app_configs.claim_item(key, movie.instance, app_configs.radarr_instances)
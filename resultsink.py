@@ -0,0 +1,71 @@
+import json
+import os
+import time
+from collections import Counter
+
+
+class JsonlSink:
+    """
+    One json line per (item, tracker) check so other tools can use the results without
+    parsing the not_found/trump files or the script log. Records are written in batches
+    through the background writer and a summary record is added when the sink is closed.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self, path, writer=None, append=False):
+        self.path = path
+        self.writer = writer
+        self.batch = []
+        self.records = 0
+        self.counts = {}
+        self.cache_hits = 0
+        self.searches = 0
+        self.search_seconds = 0.0
+        self.started = time.time()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # --resume continues the file of the interrupted run
+        self.file = open(path, "a" if append else "w", encoding="utf-8")
+        if writer is not None:
+            # closed by the writer once everything queued has been written
+            writer.add_file(self.file)
+
+    def add(self, record):
+        self.records += 1
+        self.counts.setdefault(record["tracker"], Counter())[record["status"]] += 1
+        if record.get("cache_hit"):
+            self.cache_hits += 1
+        elif record.get("latency_ms") is not None:
+            self.searches += 1
+            self.search_seconds += record["latency_ms"] / 1000
+        self.batch.append(json.dumps(record, default=str))
+        if len(self.batch) >= self.BATCH_SIZE:
+            self.flush()
+
+    def _write(self, text):
+        if self.writer is None:
+            self.file.write(text)
+        else:
+            self.writer.write(self.file.write, text)
+
+    def flush(self):
+        if self.batch:
+            self._write("\n".join(self.batch) + "\n")
+            self.batch = []
+
+    def close(self):
+        finished = time.time()
+        self.batch.append(json.dumps({
+            "type": "summary",
+            "started": self.started,
+            "finished": finished,
+            "elapsed_seconds": round(finished - self.started, 3),
+            "records": self.records,
+            "counts": {tracker: dict(counts) for tracker, counts in self.counts.items()},
+            "cache_hits": self.cache_hits,
+            "searches": self.searches,
+            "mean_search_ms": round(self.search_seconds * 1000 / self.searches, 1) if self.searches else None,
+        }))
+        self.flush()
+        if self.writer is None:
+            self.file.close()
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+from collections.abc import AsyncIterable
+from contextvars import ContextVar
+
+logger = logging.getLogger("customLogger")
+
+# per item output buffer. set inside each scheduled item task so log records and result
+# writes made while checking an item can be held back and replayed in item order.
+_item_buffer: ContextVar[list | None] = ContextVar("item_buffer", default=None)
+
+
+class ItemBufferFilter(logging.Filter):
+    # hold back records emitted while an item is checked. replayed by run_ordered
+    def filter(self, record):
+        buffer = _item_buffer.get()
+        if buffer is None:
+            return True
+        buffer.append(record)
+        return False
+
+
+def defer(func, *args):
+    """
+    Run func(*args) now, or queue it behind the current item's log output if called
+    from inside a run_ordered worker. Used for result file writes so the not_found/trump
+    files keep the same order as a sequential run.
+    """
+    buffer = _item_buffer.get()
+    if buffer is None:
+        func(*args)
+    else:
+        buffer.append((func, args))
+
+
+def replay(buffer):
+    for entry in buffer:
+        if isinstance(entry, logging.LogRecord):
+            logger.handle(entry)
+        else:
+            func, args = entry
+            func(*args)
+
+
+async def run_buffered(awaitable):
+    """
+    Await one item's check with its log output and deferred writes held back, then write
+    them in one piece. For checks that run next to each other outside run_ordered (--serve).
+    """
+    buffer = []
+    token = _item_buffer.set(buffer)
+    try:
+        return await awaitable
+    finally:
+        _item_buffer.reset(token)
+        replay(buffer)
+
+
+class ReadAhead:
+    """
+    Drains an async iterable in a background task and hands items out from a queue, so
+    the source (e.g. a streaming Arr response) is read at its own pace instead of the
+    pace of the checks. maxsize 0 means the queue is unbounded. Keep it bounded for a
+    library so items wait in the stream, not in memory.
+
+    total is None until the source is exhausted, then the number of items it produced.
+    expected is an estimate of it for progress output, e.g. the size of the last run.
+    """
+
+    def __init__(self, items, maxsize=0, expected=None):
+        self.items = items
+        self.queue = asyncio.Queue(maxsize)
+        self.count = 0
+        self.total = None
+        self.expected = expected
+
+    async def _produce(self, done):
+        try:
+            async for item in self.items:
+                self.count += 1
+                await self.queue.put(item)
+            self.total = self.count
+        except Exception as e:
+            await self.queue.put(e)
+        await self.queue.put(done)
+
+    async def __aiter__(self):
+        done = object()
+        producer = asyncio.create_task(self._produce(done))
+        try:
+            while True:
+                item = await self.queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+
+async def merge(*sources, maxsize=64):
+    """
+    Drain several async iterables at the same time and yield their items as they arrive.
+    At most maxsize items wait in between. The first source error is re-raised once the
+    items before it have been yielded.
+    """
+    if len(sources) == 1:
+        async for item in sources[0]:
+            yield item
+        return
+    queue = asyncio.Queue(maxsize)
+    done = object()
+
+    async def drain(source):
+        try:
+            async for item in source:
+                await queue.put(item)
+        except Exception as e:
+            await queue.put(e)
+        await queue.put(done)
+
+    tasks = [asyncio.create_task(drain(source)) for source in sources]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            item = await queue.get()
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _iterate(items):
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def run_ordered(items, worker, concurrency=1):
+    """
+    Await worker(index, item) for every item keeping up to `concurrency` items in flight.
+
+    Args:
+        items: iterable or async iterable of work items.
+        worker: coroutine function called as worker(index, item).
+        concurrency (int): max number of items being checked at the same time.
+
+    Output from each item is buffered and flushed in item order so the console reads
+    the same as a sequential run. The first worker exception stops the run and is re-raised.
+
+    Returns:
+        int: number of items processed.
+    """
+    concurrency = max(1, int(concurrency or 1))
+    # finished items waiting on a slower earlier item are held in memory. cap how far ahead we get
+    window = concurrency * 4
+    slots = asyncio.Semaphore(concurrency)
+    pending: dict[int, asyncio.Task] = {}
+    next_flush = 0
+
+    async def run_one(index, item):
+        buffer = []
+        _item_buffer.set(buffer)
+        async with slots:
+            try:
+                await worker(index, item)
+            except Exception as e:
+                return buffer, e
+        return buffer, None
+
+    def flush_done():
+        nonlocal next_flush
+        while next_flush in pending and pending[next_flush].done():
+            buffer, error = pending.pop(next_flush).result()
+            next_flush += 1
+            replay(buffer)
+            if error is not None:
+                raise error
+
+    iterator = _iterate(items).__aiter__()
+    exhausted = False
+    index = 0
+    try:
+        while not exhausted or pending:
+            while not exhausted and len(pending) < window:
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending[index] = asyncio.create_task(run_one(index, item))
+                index += 1
+                # let the new task grab a slot before pulling more work
+                await asyncio.sleep(0)
+                flush_done()
+
+            running = [task for task in pending.values() if not task.done()]
+            if running:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            flush_done()
+        return index
+    finally:
+        for task in pending.values():
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending.values(), return_exceptions=True)
@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import re
+import zlib
+from collections import Counter
+
+from AppConfig import AppConfig
+
+SHARD_DIR = re.compile(r"shard-(\d+)-of-(\d+)$")
+
+
+def parse_shard(value):
+    # argparse type for --shard i/N. shards are numbered 1 to N
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value}")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard {value} out of range. use 1/N to N/N")
+    return index, count
+
+
+def shard_dir_name(shard):
+    return f"shard-{shard[0]}-of-{shard[1]}"
+
+
+def in_shard(media_id, shard) -> bool:
+    # crc32 of the tmdb/tvdb id, the same in every process and python version unlike hash()
+    index, count = shard
+    return zlib.crc32(str(media_id).encode()) % count == index - 1
+
+
+def movie_in_shard(movie, shard) -> bool:
+    return in_shard(movie.tmdb_id or movie.title, shard)
+
+
+def show_in_shard(show, shard) -> bool:
+    return in_shard(show.get("tvdbId") or show.get("title"), shard)
+
+
+def apply_shard(app_configs: AppConfig, shard, shards_path, results_jsonl=None):
+    # each shard writes its output, caches and state under its own directory so shards can share a volume
+    name = shard_dir_name(shard)
+    app_configs.log_files["output_path"] = os.path.join(shards_path, name)
+    # a --results-jsonl file goes in there too, under its own name
+    if results_jsonl:
+        app_configs.log_files["results_jsonl"] = os.path.basename(results_jsonl)
+    if app_configs.cache["path"]:
+        app_configs.cache["path"] = os.path.join(os.path.expanduser(app_configs.cache["path"]), name)
+    if app_configs.incremental["state_file"]:
+        root, ext = os.path.splitext(app_configs.incremental["state_file"])
+        app_configs.incremental["state_file"] = f"{root}.{name}{ext}"
+
+
+def find_shards(shards_path):
+    # shard directories sorted by shard number
+    shards = []
+    if os.path.isdir(shards_path):
+        for entry in os.listdir(shards_path):
+            match = SHARD_DIR.match(entry)
+            if match and os.path.isdir(os.path.join(shards_path, entry)):
+                shards.append((int(match.group(1)), int(match.group(2)), os.path.join(shards_path, entry)))
+    return sorted(shards)
+
+
+def _concat(sources, target, header=False):
+    # csv files keep the header of the first shard only
+    with open(target, "w", newline="", encoding="utf-8") as out:
+        wrote_header = False
+        for source in sources:
+            with open(source, "r", newline="", encoding="utf-8") as f:
+                first = f.readline()
+                if not header or not wrote_header:
+                    out.write(first)
+                    wrote_header = True
+                for line in f:
+                    out.write(line)
+
+
+def _merge_summaries(summaries):
+    # totals of the per shard summary records of the jsonl results
+    counts = {}
+    for summary in summaries:
+        for tracker, tracker_counts in summary.get("counts", {}).items():
+            counts.setdefault(tracker, Counter()).update(tracker_counts)
+    searches = sum(summary.get("searches", 0) for summary in summaries)
+    search_ms = sum((summary.get("mean_search_ms") or 0) * summary.get("searches", 0) for summary in summaries)
+    started = min(summary["started"] for summary in summaries)
+    finished = max(summary["finished"] for summary in summaries)
+    return {
+        "type": "summary",
+        "shards": len(summaries),
+        "started": started,
+        "finished": finished,
+        "elapsed_seconds": round(finished - started, 3),
+        "records": sum(summary.get("records", 0) for summary in summaries),
+        "counts": {tracker: dict(tracker_counts) for tracker, tracker_counts in counts.items()},
+        "cache_hits": sum(summary.get("cache_hits", 0) for summary in summaries),
+        "searches": searches,
+        "mean_search_ms": round(search_ms / searches, 1) if searches else None,
+    }
+
+
+def _merge_jsonl(sources, target):
+    summaries = []
+    with open(target, "w", encoding="utf-8") as out:
+        for source in sources:
+            with open(source, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record.get("type") == "summary":
+                        summaries.append(record)
+                    else:
+                        out.write(line if line.endswith("\n") else f"{line}\n")
+        if summaries:
+            out.write(json.dumps(_merge_summaries(summaries)) + "\n")
+
+
+def merge(app_configs: AppConfig, shards_path, results_jsonl=None):
+    """
+    Combines the not_found/trump files and jsonl results of every shard under shards_path
+    into the normal <output_path>/<TRACKER>/ layout. Lines keep their order within each
+    shard, shards are added in shard order. The jsonl results of shards run with
+    --results-jsonl are merged into that path. Returns the (merged file, shards merged)
+    pairs and the numbers of any shards with no output.
+    """
+    shards = find_shards(shards_path)
+    if not shards:
+        raise FileNotFoundError(f"No shard output found in {shards_path}")
+    counts = {count for _, count, _ in shards}
+    if len(counts) > 1:
+        raise ValueError(f"Shards of different runs in {shards_path}: {", ".join(shard_dir_name(s[:2]) for s in shards)}")
+    missing = sorted(set(range(1, counts.pop() + 1)) - {index for index, _, _ in shards})
+
+    output_path = os.path.expanduser(app_configs.log_files["output_path"] or "")
+    csv_names = (app_configs.log_files["trump_radarr"], app_configs.log_files["trump_sonarr"])
+    text_names = (app_configs.log_files["not_found_radarr"], app_configs.log_files["not_found_sonarr"])
+    # tracker -> file name -> shard files
+    sources = {}
+    for _, _, shard_path in shards:
+        for tracker in sorted(os.listdir(shard_path)):
+            for name in (*text_names, *csv_names):
+                path = os.path.join(shard_path, tracker, name)
+                if os.path.isfile(path):
+                    sources.setdefault(tracker, {}).setdefault(name, []).append(path)
+
+    merged = []
+    for tracker, files in sources.items():
+        os.makedirs(os.path.join(output_path, tracker), exist_ok=True)
+        for name, paths in files.items():
+            target = os.path.join(output_path, tracker, name)
+            _concat(paths, target, header=name in csv_names)
+            merged.append((target, len(paths)))
+
+    name = os.path.basename(results_jsonl) if results_jsonl else app_configs.log_files["results_jsonl"]
+    if name:
+        paths = [os.path.join(shard_path, name) for _, _, shard_path in shards]
+        paths = [path for path in paths if os.path.isfile(path)]
+        if paths:
+            target = results_jsonl or os.path.join(output_path, name)
+            _merge_jsonl(paths, target)
+            merged.append((target, len(paths)))
+    return merged, missing
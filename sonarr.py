@@ -1,22 +1,59 @@
 import asyncio
-import time
+import json
 from os.path import basename
 
-from guessit import guessit
 import logging
+import profiling
+import scheduler
+import utils
 from AppConfig import AppConfig
+from models import SeasonItem
 
 logger = logging.getLogger("customLogger")
 
-async def get_season_episodes(session, show, season_number, app_configs: AppConfig):
-    url = app_configs.sonarr['url'] + f"/api/v3/episode?seriesId={show["id"]}&seasonNumber={season_number}&includeSeries=false&includeEpisodeFile=true&includeImages=false"
-    async with session.get(url, headers={"X-Api-Key": app_configs.sonarr['api_key']}) as response:
+# pull every episode of a series in one call and group them by season
+async def get_series_episodes(session, show, app_configs: AppConfig):
+    instance = show.get("instance") or app_configs.sonarr_instances[0]
+    url = instance['url'] + f"/api/v3/episode?seriesId={show["id"]}&includeSeries=false&includeEpisodeFile=true&includeImages=false"
+    async with session.get(url, headers={"X-Api-Key": instance['api_key']}) as response:
         response.raise_for_status()  # Raise an exception if the request failed
-        res = await response.json()
-        return res
+        with profiling.phase("library download", cpu=False):
+            body = await response.read()
+    with profiling.phase("json decode"):
+        res = json.loads(body)
+    seasons = {}
+    for episode in sorted(res, key=lambda ep: (ep.get("seasonNumber", 0), ep.get("episodeNumber", 0))):
+        seasons.setdefault(episode.get("seasonNumber"), []).append(episode)
+    return seasons
 
-# Function to process each show
-async def process_show(session, show, trackers, app_configs: AppConfig):
+# complete, non special seasons that changed since the last run (or every one outside incremental mode)
+# and weren't finished before a --resume
+def season_needs_check(show, season, app_configs: AppConfig) -> bool:
+    if season["seasonNumber"] <= 0 or season['statistics']["percentOfEpisodes"] != 100:
+        return False
+    if checked_before_resume(show, season["seasonNumber"], app_configs.trackers, app_configs):
+        return False
+    return app_configs.scan_state is None or app_configs.scan_state.season_changed(show, season)
+
+# every tracker finished the season before a --resume, so its episodes aren't needed. with several
+# instances they still are, the season is claimed by its episode file so the others skip it
+def checked_before_resume(show, season_number, trackers, app_configs: AppConfig) -> bool:
+    if app_configs.checkpoint is None or len(app_configs.sonarr_instances) > 1:
+        return False
+    return not app_configs.checkpoint.season_pending(show, season_number, trackers)
+
+# producer stage. pulls episodes for upcoming shows while earlier shows are still being
+# searched on the trackers. wrap in a bounded ReadAhead to cap how far ahead it runs
+async def prefetch_episodes(session, shows, app_configs: AppConfig):
+    async for show in shows:
+        episodes_by_season = None
+        if any(season_needs_check(show, season, app_configs) for season in show["seasons"]):
+            episodes_by_season = await get_series_episodes(session, show, app_configs)
+        yield show, episodes_by_season
+
+# Function to process each show. episodes_by_season is fetched here unless prefetched.
+# claim skips seasons another instance already checked in this run
+async def process_show(session, show, trackers, app_configs: AppConfig, episodes_by_season=None, claim=True):
     # add newline to put list below title if multiple checks
     # and tab indent sub items
     indented = False
@@ -30,27 +67,58 @@ async def process_show(session, show, trackers, app_configs: AppConfig):
 
         # skip specials and incomplete seasons for now
         if season_number > 0 and season['statistics']["percentOfEpisodes"] == 100:
-            # pull episodes for the season
-            episodes = await get_season_episodes(session, show, season_number, app_configs)
+            # incremental runs skip seasons with no file changes since the last check
+            if app_configs.scan_state is not None and not app_configs.scan_state.season_changed(show, season):
+                logger.debug(
+                    f"\tSeason {"{:02d}".format(season_number)} SKIPPED. Unchanged since last run."
+                )
+                continue
+            if checked_before_resume(show, season_number, trackers, app_configs):
+                logger.info(
+                    f"\tSeason {"{:02d}".format(season_number)} SKIPPED. Checked before resume."
+                )
+                continue
+            # pull episodes for the whole show once
+            if episodes_by_season is None:
+                episodes_by_season = await get_series_episodes(session, show, app_configs)
             # get resolution and type from first ep. assume season pack and all the same
-            episode = episodes[0]
+            episodes = episodes_by_season.get(season_number, [])
+            episode = episodes[0] if len(episodes) > 0 else {}
 
             # should be issue due to 100% check. incase file missing sonarr hasn't been updated.
             if "episodeFile" in episode:
-                filename = episode.get("episodeFile").get("relativePath")
-                if "sceneName" in episode.get("episodeFile"):
-                    filename = episode.get("episodeFile").get("sceneName")
+                season_item = SeasonItem.from_sonarr(show, season_number, episode["episodeFile"])
+                # same season, resolution and type already checked from another instance. off for --serve
+                owner = app_configs.claim_item(
+                    ("season", season_item.tvdb_id, season_number, season_item.resolution, season_item.video_type),
+                    season_item.instance, app_configs.sonarr_instances
+                ) if claim else None
+                if owner is not None:
+                    logger.info(
+                        f"\tSeason {"{:02d}".format(season_number)} SKIPPED. Already checked in {owner}."
+                    )
+                    if app_configs.scan_state is not None:
+                        app_configs.scan_state.mark_season(show, season, season_item)
+                    continue
+                # trackers that haven't finished the season before a --resume
+                pending = app_configs.checkpoint.pending("sonarr", season_item, trackers) if app_configs.checkpoint is not None else trackers
+                if not pending:
+                    logger.info(
+                        f"\tSeason {"{:02d}".format(season_number)} SKIPPED. Checked before resume."
+                    )
+                    continue
                 logger.debug(
-                    f"\tSource: {basename(filename)}"
+                    f"\tSource: {basename(season_item.filename)}"
                 )
                 # display missing release group warning. So only once and not duplicated per tracker.
-                if "releaseGroup" in episode["episodeFile"] and not episode["episodeFile"]["releaseGroup"].strip():
+                if not season_item.release_group:
                     logger.warning(
                         f"\tWarning: Release group missing. Banned checks will be skipped."
                     )
-                tasks = [tracker.search_show(session, show, season_number, episode, indented) for tracker in trackers]
-                await asyncio.gather(*tasks)
-                time.sleep(app_configs.sleep_timer)
+                tasks = [tracker.search_show(session, season_item, indented) for tracker in pending]
+                # seasons with a failed search stay changed for the next incremental run
+                if all(await asyncio.gather(*tasks)) and app_configs.scan_state is not None:
+                    app_configs.scan_state.mark_season(show, season, season_item)
             else:
                 logger.debug(
                     f"\tSeason {"{:02d}".format(season_number)} SKIPPED. Missing local files."
@@ -65,10 +133,33 @@ async def process_show(session, show, trackers, app_configs: AppConfig):
                     f"\tSeason {"{:02d}".format(season_number)} SKIPPED. Specials not implemented."
                 )
 
-# Function to get all shows from Sonarr
-async def get_all_shows(session, app_configs: AppConfig):
-    sonarr_url = app_configs.sonarr['url'] + app_configs.sonarr['api_suffix']
-    async with session.get(sonarr_url, headers={"X-Api-Key": app_configs.sonarr['api_key']})as response:
+# only fields the checks use. images, alternate titles etc. are dropped as each show arrives
+SHOW_FIELDS = ("id", "title", "year", "tvdbId", "tmdbId", "imdbId", "seasons")
+
+# Function to get all shows from Sonarr. yields shows as the response streams in
+async def get_all_shows(session, app_configs: AppConfig, instance=None):
+    instance = instance or app_configs.sonarr_instances[0]
+    sonarr_url = instance['url'] + instance['api_suffix']
+    async with session.get(sonarr_url, headers={"X-Api-Key": instance['api_key']})as response:
         response.raise_for_status()  # Ensure we handle request errors properly
-        shows = await response.json()
-        return shows
\ No newline at end of file
+        async for show in utils.iter_json_array(response):
+            yield trim_show(show, instance)
+
+def trim_show(show, instance):
+    show = {key: show[key] for key in SHOW_FIELDS if key in show}
+    # episodes are fetched from the same instance
+    show["instance"] = instance
+    return show
+
+# one show by sonarr id. used by --serve to load the series a webhook was sent for
+async def get_show(session, instance, series_id):
+    sonarr_url = instance['url'] + instance['api_suffix'] + f"/{series_id}"
+    async with session.get(sonarr_url, headers={"X-Api-Key": instance['api_key']}) as response:
+        response.raise_for_status()
+        show = await response.json()
+    return trim_show(show, instance)
+
+# shows from every enabled instance, downloaded at the same time and merged as they arrive
+def get_shows(session, app_configs: AppConfig):
+    instances = [instance for instance in app_configs.sonarr_instances if instance["enabled"]]
+    return scheduler.merge(*(get_all_shows(session, app_configs, instance) for instance in instances))
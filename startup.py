@@ -0,0 +1,53 @@
+import importlib._bootstrap
+import sys
+import time
+
+# imported first by main so --startup-timing sees every later import. argparse hasn't run yet
+ENABLED = "--startup-timing" in sys.argv
+
+STARTED = time.perf_counter()
+# module -> [cumulative seconds, self seconds]
+imports = {}
+# (name, seconds since start) in the order reached
+marks = []
+_stack = []
+
+if ENABLED:
+    _find_and_load = importlib._bootstrap._find_and_load
+
+    def _timed_find_and_load(name, import_):
+        # same hook -X importtime uses internally. nested imports are taken off the parent's self time
+        if name in sys.modules:
+            return _find_and_load(name, import_)
+        _stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return _find_and_load(name, import_)
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = _stack.pop()
+            if _stack:
+                _stack[-1] += elapsed
+            imports[name] = [elapsed, elapsed - nested]
+
+    importlib._bootstrap._find_and_load = _timed_find_and_load
+
+
+def mark(name):
+    # end of a startup step
+    if ENABLED:
+        marks.append((name, time.perf_counter() - STARTED))
+
+
+def report(top=20):
+    lines = [f"{"Step":<28} {"ms":>8}"]
+    previous = 0.0
+    for name, at in marks:
+        lines.append(f"{name:<28} {(at - previous) * 1000:>8.1f}")
+        previous = at
+    lines.append(f"{"total":<28} {previous * 1000:>8.1f}")
+    lines.append("")
+    lines.append(f"{"Module":<40} {"Cumulative ms":>14} {"Self ms":>9}")
+    for name, (cumulative, own) in sorted(imports.items(), key=lambda item: item[1][0], reverse=True)[:top]:
+        lines.append(f"{name:<40} {cumulative * 1000:>14.1f} {own * 1000:>9.1f}")
+    return "\n".join(lines)
@@ -1,9 +1,13 @@
 import logging
 import os
-from guessit import guessit
+import time
+import re
+import cache
+import profiling
 import radarr
 import utils
 from AppConfig import AppConfig
+from models import MediaItem, SeasonItem
 from trackers.TrackerBase import TrackerBase
 
 logger = logging.getLogger("customLogger")
@@ -12,9 +16,9 @@ class AITHER(TrackerBase):
     def __init__(self, app_configs: AppConfig):
         super().__init__()
         self.URL =  "https://aither.cc"
-        trkr = next((sub for sub in app_configs.tracker_configs if sub["name"] == __class__.__name__), None)
-        if trkr:
-            self.api_key = trkr.get("api_key")
+        # largest page size the filter api allows. used for catalog sync
+        self.CATALOG_PAGE_SIZE = 100
+        self.load_tracker_config(app_configs)
         self.app_configs = app_configs
         self.setup_log_files(app_configs)
         pass
@@ -86,6 +90,7 @@ class AITHER(TrackerBase):
 
         return resolutions
 
+    @profiling.timed("url build")
     def get_search_url(self, category, video_resolutions, video_type, tmdb_id=None, tvdb_id=None, season_number=None):
         # build the search url
         category_id = self.get_cat_id(category.upper())
@@ -105,21 +110,60 @@ class AITHER(TrackerBase):
 
         return search_url
 
-    async def search_movie(self, session, movie, indented):
+    async def search_torrents(self, session, search_url, category, media_id, video_resolutions, video_type, season_number=None):
+        # torrent names matching the search. from the catalog snapshot when enabled else the filter api
+        if self.catalog_enabled:
+            await self.ensure_catalog(session)
+            return self.catalog_lookup(category, media_id, video_resolutions, video_type, season_number)
+        res = await self.fetch_json(session, search_url, headers={"Authorization": f"Bearer {self.api_key}"})
+        return [torrent.get("attributes").get("name") for torrent in res["data"]]
+
+    async def fetch_catalog(self, session):
+        index = {}
+        for category in ["MOVIE", "TV"]:
+            base_url = f"{self.URL}/api/torrents/filter?categories[0]={self.get_cat_id(category)}&perPage={self.CATALOG_PAGE_SIZE}"
+            url = f"{base_url}&page=1"
+            page = 1
+            while url:
+                res = await self.fetch_json(session, url, coalesce=False, headers={"Authorization": f"Bearer {self.api_key}"})
+                torrents = res.get("data", [])
+                for torrent in torrents:
+                    attributes = torrent.get("attributes", {})
+                    media_id = attributes.get("tmdb_id") if category == "MOVIE" else attributes.get("tvdb_id")
+                    if not media_id:
+                        continue
+                    season_number = attributes.get("season_number")
+                    if season_number is None and category == "TV":
+                        season_match = re.search(r"\bS(\d{1,2})(?!\d)", attributes.get("name", ""))
+                        season_number = int(season_match.group(1)) if season_match else None
+                    index.setdefault(f"{category}:{media_id}", []).append([
+                        attributes.get("resolution_id"),
+                        attributes.get("type_id"),
+                        season_number,
+                        attributes.get("name"),
+                    ])
+                logger.debug(f"[{self.__class__.__name__}] catalog {category} page {page}: {len(torrents)} torrents")
+
+                # newer UNIT3D returns a next page link. fall back to page numbers when there are no links
+                page += 1
+                next_url = (res.get("links") or {}).get("next")
+                if next_url:
+                    url = next_url
+                elif "links" not in res and len(torrents) == self.CATALOG_PAGE_SIZE:
+                    url = f"{base_url}&page={page}"
+                else:
+                    url = None
+        return index
+
+    async def search_movie(self, session, movie: MediaItem, indented):
         # update banned groups if tracker supports it
-        if len(self.banned_groups) == 0:
-            try:
-                banned_groups = await self.fetch_banned_groups(session)
-                self.banned_groups = banned_groups
-            except Exception as e:
-                logger.error(f"\n[{self.__class__.__name__}]Error fetching banned groups failed: {str(e)}")
+        await self.refresh_banned_groups(session)
 
-        tmdb_id = movie["tmdbId"]
-        quality_info = movie.get("movieFile").get("quality").get("quality")
-        source = quality_info.get("source")
-        modifier = quality_info.get("modifier")
+        tmdb_id = movie.tmdb_id
+        source = movie.source
+        modifier = movie.modifier
         if modifier == "none" and source == "dvd":
-            release_info = guessit(movie.get("movieFile").get("relativePath"))
+            release_info = await self.parse_release(movie.relative_path)
             modifier = release_info.get("other")
         video_type = utils.get_video_type(source, modifier)
         video_type_id = None
@@ -135,82 +179,60 @@ class AITHER(TrackerBase):
         search_url = self.get_search_url("MOVIE", video_resolutions, video_type_id, tmdb_id)
 
         # check if local group is banned on tracker
-        if "releaseGroup" in movie["movieFile"] and movie["movieFile"]["releaseGroup"].strip():
-            release_group = movie["movieFile"]["releaseGroup"]
-            if self.is_group_banned(release_group, log_prefix):
-                return
+        if movie.release_group:
+            if self.is_group_banned(movie.release_group, log_prefix):
+                self.record_result("radarr", movie, media_resolution, video_type, {"status": "banned_local"})
+                return True
 
-        try:
-            # async with session.get(search_url, headers={"Authorization": f"Bearer {self.api_key}"}) as response:
-            async with session.get(search_url, headers={"Authorization": f"Bearer {self.api_key}"}) as response:
-                res = await response.json()
-                torrents = res["data"]
-
-                if len(torrents) == 0:
-                    try:
-                        movie_file = movie["movieFile"]["path"]
-                        if movie_file:
-                            logger.info(
-                                f"{log_prefix}not found"
-                            )
-                            self.radarr_not_found_file.write(f"{movie_file}\n")
-                        else:
-                            logger.info(
-                                f"{log_prefix}not found. (No media file)"
-                            )
-                    except KeyError:
-                        logger.info(
-                            f"{log_prefix}not found. (No media file)"
-                        )
+        query = cache.query_key("MOVIE", tmdb_id, resolutions=video_resolutions, video_type=video_type_id)
+        local_file = cache.file_key(movie)
+        started = time.monotonic()
+        result = self.cached_result(query, local_file)
+        cache_hit = result is not None
+        error = None
+        if result is None:
+            try:
+                torrents = await self.search_torrents(session, search_url, "MOVIE", tmdb_id, video_resolutions, video_type_id)
+                result = await self.result_from_torrents(torrents)
+                self.store_result(query, local_file, result)
+            except Exception as e:
+                error = str(e)
+                if "429" in str(e):
+                    logger.error(f"{log_prefix}Rate limit exceeded.")
                 else:
-                    release_info = guessit(torrents[0].get("attributes").get("name"))
-                    if "release_group" in release_info \
-                            and release_info["release_group"].casefold() in map(str.casefold, self.banned_groups):
-                        title = movie["title"]
-                        logger.info(
-                            f"{log_prefix} Trumpable: Banned Group: {release_info['release_group']}"
-                        )
-                        movie_file = movie["movieFile"]["path"]
-                        if movie_file:
-                            self.radarr_trump_writer.writerow({'file': movie_file, 'reason': 'Banned group'})
-                    else:
-                        logger.info(
-                            f"{log_prefix}already exists"
-                        )
-        except Exception as e:
-            if "429" in str(e):
-                logger.error(f"{log_prefix}Rate limit exceeded.")
-            else:
-                logger.error(f"{log_prefix}Error: {str(e)}")
-                self.radarr_not_found_file.write(f"{title} - Error: {str(e)}\n")
+                    logger.error(f"{log_prefix}Error: {str(e)}")
+                    self.write_not_found("radarr", f"{movie.title} - Error: {str(e)}")
+        else:
+            logger.debug(f"{"\t" if indented else ""}[{self.__class__.__name__}] cache hit: {query}")
+        if result is not None:
+            self.report_result("radarr", result, log_prefix, movie.path)
+        self.record_result("radarr", movie, media_resolution, video_type, result or {"status": "error", "error": error},
+                           time.monotonic() - started, cache_hit)
 
         logger.debug(
             f"{"\t"if indented else ""}[{self.__class__.__name__}] search url: {search_url}"
         )
+        # False when the search failed so the item is checked again next run
+        return result is not None
 
-    async def search_show(self, session, show, season_number, episode, indented):
+    async def search_show(self, session, season: SeasonItem, indented):
         # update banned groups if tracker supports it
-        if len(self.banned_groups) == 0:
-            try:
-                banned_groups = await self.fetch_banned_groups(session)
-                self.banned_groups = banned_groups
-            except Exception as e:
-                logger.error(f"\n[{self.__class__.__name__}]\nError fetching banned groups failed: {str(e)}")
+        await self.refresh_banned_groups(session)
 
-        quality_info = episode.get("episodeFile").get("quality").get("quality")
-        source = quality_info.get("source")
-        video_type = quality_info.get("name")  # WEBDL-1080p
+        season_number = season.season_number
+        source = season.source
+        video_type = season.quality_name  # WEBDL-1080p
         if video_type.lower() == "dvd" and source.lower() == "dvd":
-            release_info = guessit(episode.get("episodeFile").get("relativePath"))
+            release_info = await self.parse_release(season.relative_path)
             video_type = release_info.get("other")
 
         video_type = utils.get_video_type(source, video_type)
         tracker_type = None
         if video_type != "OTHER":
             tracker_type = self.get_type_id(video_type.upper())
-        media_resolution = str(quality_info.get("resolution"))
+        media_resolution = str(season.resolution)
         video_resolutions = self.get_video_resolutions(media_resolution)
-        tvdb_id = show["tvdbId"]
+        tvdb_id = season.tvdb_id
 
         # search_url = f"{self.URL}/api/torrents/filter?tvdbId={tvdb_id}&categories[0]={category_id}"
         search_url = self.get_search_url("TV", video_resolutions, tracker_type, tvdb_id=tvdb_id, season_number=season_number)
@@ -220,65 +242,44 @@ class AITHER(TrackerBase):
         log_prefix += f"Season {"{:02d}".format(season_number)} [{media_resolution} {video_type}]... "
 
         # check if local group is banned on tracker
-        if "releaseGroup" in episode["episodeFile"] and episode["episodeFile"]["releaseGroup"].strip():
-            release_group = episode["episodeFile"]["releaseGroup"]
-            if self.is_group_banned(release_group, log_prefix):
-                return
+        if season.release_group:
+            if self.is_group_banned(season.release_group, log_prefix):
+                self.record_result("sonarr", season, media_resolution, video_type, {"status": "banned_local"})
+                return True
 
-        try:
-            # async with session.get(search_url, headers={"Authorization": f"Bearer {self.api_key}"}) as response:
-            async with session.get(search_url,
-                                        headers={"Authorization": f"Bearer {self.api_key}"}) as response:
-                res = await response.json()
-                torrents = res["data"]
-
-                if len(torrents) == 0:
-                    logger.info(
-                        f"{log_prefix}not found"
-                    )
-                    filepath = os.path.dirname(episode["episodeFile"]["path"])
-                    self.sonarr_not_found_file.write(f"{filepath}\n")
+        query = cache.query_key("TV", tvdb_id, season_number, video_resolutions, tracker_type)
+        local_file = cache.file_key(season)
+        started = time.monotonic()
+        result = self.cached_result(query, local_file)
+        cache_hit = result is not None
+        error = None
+        if result is None:
+            try:
+                torrents = await self.search_torrents(session, search_url, "TV", tvdb_id, video_resolutions, tracker_type, season_number)
+                result = await self.result_from_torrents(torrents)
+                self.store_result(query, local_file, result)
+            except Exception as e:
+                error = str(e)
+                if "429" in str(e):
+                    logger.error(f"{log_prefix}Rate limit exceeded while checking.")
                 else:
-                    release_info = guessit(torrents[0].get("attributes").get("name"))
-                    if "release_group" in release_info \
-                            and release_info["release_group"].casefold() in map(str.casefold, self.banned_groups):
-                        logger.info(
-                            f"{log_prefix} Trumpable: Banned Group: {release_info['release_group']}"
-                        )
-                        filepath = os.path.dirname(episode["episodeFile"]["path"])
-                        if filepath:
-                            self.sonarr_trump_writer.writerow({'file': filepath, 'reason': 'Banned group'})
-                    else:
-                        logger.info(
-                            f"{log_prefix}already exists"
-                        )
-        except Exception as e:
-            if "429" in str(e):
-                logger.error(f"{log_prefix}Rate limit exceeded while checking.")
-            else:
-                logger.error(f"{log_prefix}Error: {str(e)}")
-                self.sonarr_not_found_file.write(f"Error: {str(e)}\n")
+                    logger.error(f"{log_prefix}Error: {str(e)}")
+                    self.write_not_found("sonarr", f"Error: {str(e)}")
+        else:
+            logger.debug(f"{"\t" if indented else ""}[{self.__class__.__name__}] cache hit: {query}")
+        if result is not None:
+            self.report_result("sonarr", result, log_prefix, os.path.dirname(season.path))
+        self.record_result("sonarr", season, media_resolution, video_type, result or {"status": "error", "error": error},
+                           time.monotonic() - started, cache_hit)
 
         logger.debug(
             f"\t[{self.__class__.__name__}] search url: {search_url}"
         )
+        return result is not None
 
-    # pull banned groups from aither api
-    async def fetch_banned_groups(self, session):
-        # logger.info("Fetching banned groups")
+    # aither blacklist api. fetched, cached and refreshed by TrackerBase.refresh_banned_groups
+    def get_banned_groups_url(self):
+        return f"{self.URL}/api/blacklists/releasegroups?api_token={self.api_key}"
 
-        banned_groups = []
-        url = f"{self.URL}/api/blacklists/releasegroups?api_token={self.api_key}"
-        try:
-            # async with session.get(search_url, headers={"Authorization": f"Bearer {self.api_key}"}) as response:
-            async with session.get(url,
-                                        headers={"Authorization": f"Bearer {self.api_key}"}) as response:
-                res = await response.json()
-                groups = res["data"]
-                banned_groups = [d['name'] for d in groups]
-        except Exception as e:
-            if "429" in str(e):
-                logger.warning(f"Rate limit exceeded while checking.")
-            else:
-                logger.error(f"Error: {str(e)}")
-        return banned_groups
+    def parse_banned_groups(self, res):
+        return [d['name'] for d in res["data"]]
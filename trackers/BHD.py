@@ -1,23 +1,27 @@
 import logging
 import os
+import time
 import utils
 from AppConfig import AppConfig
+from models import MediaItem, SeasonItem
 from trackers.TrackerBase import TrackerBase
-from guessit import guessit
+import cache
+import profiling
 
 
 logger = logging.getLogger("customLogger")
 
 class BHD(TrackerBase):
+    # BHD has no blacklist api. override with banned_groups in the [[trackers]] entry
+    DEFAULT_BANNED_GROUPS = ['Sicario', 'TOMMY', 'x0r', 'nikt0', 'FGT', 'd3g', 'MeGusta', 'YIFY', 'tigole', 'TEKNO3D', 'C4K', 'RARBG', '4K4U', 'EASports', 'ReaLHD', 'Telly', 'AOC', 'WKS', 'SasukeducK']
+
     def __init__(self, app_configs: AppConfig):
         super().__init__()
         self.URL =  "https://beyond-hd.me"
-        trkr = next((sub for sub in app_configs.tracker_configs if sub["name"] == __class__.__name__), None)
-        if trkr:
-            self.api_key = trkr.get("api_key")
+        trkr = self.load_tracker_config(app_configs)
         self.app_configs = app_configs
         self.setup_log_files(app_configs)
-        self.banned_groups = ['Sicario', 'TOMMY', 'x0r', 'nikt0', 'FGT', 'd3g', 'MeGusta', 'YIFY', 'tigole', 'TEKNO3D', 'C4K', 'RARBG', '4K4U', 'EASports', 'ReaLHD', 'Telly', 'AOC', 'WKS', 'SasukeducK']
+        self.set_banned_groups((trkr or {}).get("banned_groups", self.DEFAULT_BANNED_GROUPS))
         pass
 
     def get_cat_id(self, category_name):
@@ -93,6 +97,7 @@ class BHD(TrackerBase):
 
         return resolutions
 
+    @profiling.timed("url build")
     def get_search_url(self, category, tracker_types, tracker_source, tmdb_id=None, imdb_id=None, season_number=None):
         # build the search url
         category_id = self.get_cat_id(category)
@@ -117,20 +122,18 @@ class BHD(TrackerBase):
             url += f"&search=S{"0" if season_number < 10 else ""}{season_number}"
         return url
 
-    async def search_movie(self, session, movie, indented):
-        tmdb_id = movie["tmdbId"]
+    async def search_movie(self, session, movie: MediaItem, indented):
+        tmdb_id = movie.tmdb_id
 
         # update banned groups if tracker supports it
-        if len(self.banned_groups) == 0:
-            logger.error(f"\n[{self.__class__.__name__}] Banned groups empty. Skipping checks.")
+        await self.refresh_banned_groups(session)
 
-        quality_info = movie.get("movieFile").get("quality").get("quality")
-        source = quality_info.get("source")
-        modifier = quality_info.get("modifier")
-        resolution = quality_info.get("resolution")
+        source = movie.source
+        modifier = movie.modifier
+        resolution = movie.resolution
         tracker_source = self.get_source_id(source)
         if tracker_source is None or "DVD" in tracker_source.upper():
-            release_info = guessit(movie.get("movieFile").get("relativePath"))
+            release_info = await self.parse_release(movie.relative_path)
             source = release_info.get("source")
             modifier = release_info.get("other")
             if resolution == 0 and "screen_size" in release_info:
@@ -152,76 +155,53 @@ class BHD(TrackerBase):
         search_url = self.get_search_url("MOVIE", tracker_types, tracker_source, tmdb_id)
 
         # check if local group is banned on tracker
-        if "releaseGroup" in movie["movieFile"] and movie["movieFile"]["releaseGroup"].strip():
-            release_group = movie["movieFile"]["releaseGroup"]
-            if self.is_group_banned(release_group, log_prefix):
-                return
-
-        try:
-            # async with session.get(search_url, headers={"Authorization": f"Bearer {self.api_key}"}) as response:
-            async with session.post(search_url,
-                                        headers={"Authorization": f"Bearer {self.api_key}"}) as response:
-                # response.raise_for_status()  # Raise an exception if the request failed
-                res = await response.json()
-                torrents = res["results"]
+        if movie.release_group:
+            if self.is_group_banned(movie.release_group, log_prefix):
+                self.record_result("radarr", movie, resolution, tracker_source, {"status": "banned_local"})
+                return True
 
-                if len(torrents) == 0:
-                    try:
-                        movie_file = movie["movieFile"]["path"]
-                        if movie_file:
-                            logger.info(
-                                f"{log_prefix}not found"
-                            )
-                            self.radarr_not_found_file.write(f"{movie_file}\n")
-                        else:
-                            logger.info(
-                                f"{log_prefix}not found. (No media file)"
-                            )
-                    except KeyError:
-                        logger.info(
-                            f"{log_prefix}not found. (No media file)"
-                        )
+        query = cache.query_key("MOVIE", tmdb_id, resolutions=tracker_types, video_type=tracker_source)
+        local_file = cache.file_key(movie)
+        started = time.monotonic()
+        result = self.cached_result(query, local_file)
+        cache_hit = result is not None
+        error = None
+        if result is None:
+            try:
+                res = await self.fetch_json(session, search_url, method="POST", headers={"Authorization": f"Bearer {self.api_key}"})
+                result = await self.result_from_torrents([torrent.get("name") for torrent in res["results"]])
+                self.store_result(query, local_file, result)
+            except Exception as e:
+                error = str(e)
+                if "429" in str(e):
+                    logger.error(f"{log_prefix}Rate limit exceeded while checking.")
                 else:
-                    release_info = guessit(torrents[0].get("name"))
-                    if "release_group" in release_info \
-                            and release_info["release_group"].casefold() in map(str.casefold, self.banned_groups):
-                        logger.info(
-                            f"{log_prefix} Trumpable: Banned Group: {release_info['release_group']}"
-                        )
-                        movie_file = movie["movieFile"]["path"]
-                        if movie_file:
-                            self.radarr_trump_writer.writerow({'file': movie_file, 'reason': 'Banned group'})
-                    else:
-                        logger.info(
-                            f"{log_prefix}already exists"
-                        )
-        except Exception as e:
-            if "429" in str(e):
-                logger.error(f"{log_prefix}Rate limit exceeded while checking.")
-            else:
-                logger.error(f"{log_prefix}Error: {str(e)}")
-                self.radarr_not_found_file.write(f"Error: {str(e)}\n")
+                    logger.error(f"{log_prefix}Error: {str(e)}")
+                    self.write_not_found("radarr", f"Error: {str(e)}")
+        else:
+            logger.debug(f"{"\t" if indented else ""}[{self.__class__.__name__}] cache hit: {query}")
+        if result is not None:
+            self.report_result("radarr", result, log_prefix, movie.path)
+        self.record_result("radarr", movie, resolution, tracker_source, result or {"status": "error", "error": error},
+                           time.monotonic() - started, cache_hit)
 
         logger.debug(
             f"{"\t"if indented else ""}[{self.__class__.__name__}] search url: {search_url}"
         )
+        # a failed search returns False so incremental runs check the item again
+        return result is not None
 
-    async def search_show(self, session, show, season_number, episode, indented):
+    async def search_show(self, session, season: SeasonItem, indented):
         # update banned groups if tracker supports it
-        if len(self.banned_groups) == 0:
-            try:
-                banned_groups = await self.fetch_banned_groups(session)
-                self.banned_groups = banned_groups
-            except Exception as e:
-                logger.error(f"\n[{self.__class__.__name__}] Error fetching banned groups failed: {str(e)}")
+        await self.refresh_banned_groups(session)
 
-        quality_info = episode.get("episodeFile").get("quality").get("quality")
-        source = quality_info.get("source")
-        modifier = quality_info.get("modifier")
-        resolution = quality_info.get("resolution")
+        season_number = season.season_number
+        source = season.source
+        modifier = season.modifier
+        resolution = season.resolution
         tracker_source = self.get_source_id(source)
         if tracker_source is None or "DVD" in tracker_source.upper():
-            release_info = guessit(episode.get("episodeFile").get("relativePath"))
+            release_info = await self.parse_release(season.relative_path)
             source = release_info.get("source")
             if modifier is None:
                 modifier = release_info.get("other")
@@ -237,10 +217,8 @@ class BHD(TrackerBase):
             tracker_source = tracker_types
 
         # build the search url
-        tmdb_id = show["tmdbId"]
-        imdb_id = None
-        if "imdbId" in show:
-            imdb_id = show["imdbId"]
+        tmdb_id = season.tmdb_id
+        imdb_id = season.imdb_id
         log_prefix = f"\t"
         if indented:
             log_prefix += f"[{self.__class__.__name__}] "
@@ -249,44 +227,37 @@ class BHD(TrackerBase):
                                          season_number=season_number)
 
         # check if local group is banned on tracker
-        if "releaseGroup" in episode["episodeFile"] and episode["episodeFile"]["releaseGroup"].strip():
-            release_group = episode["episodeFile"]["releaseGroup"]
-            if self.is_group_banned(release_group, log_prefix):
-                return
-
-        try:
-            async with session.post(search_url,
-                                        headers={"Authorization": f"Bearer {self.api_key}"}) as response:
-                res = await response.json()
-                torrents = res["results"]
+        if season.release_group:
+            if self.is_group_banned(season.release_group, log_prefix):
+                self.record_result("sonarr", season, resolution, tracker_source, {"status": "banned_local"})
+                return True
 
-                if len(torrents) == 0:
-                    logger.info(
-                        f"{log_prefix}not found"
-                    )
-                    filepath = os.path.dirname(episode["episodeFile"]["path"])
-                    self.sonarr_not_found_file.write(f"{filepath}\n")
+        query = cache.query_key("TV", tmdb_id, season_number, tracker_types, tracker_source)
+        local_file = cache.file_key(season)
+        started = time.monotonic()
+        result = self.cached_result(query, local_file)
+        cache_hit = result is not None
+        error = None
+        if result is None:
+            try:
+                res = await self.fetch_json(session, search_url, method="POST", headers={"Authorization": f"Bearer {self.api_key}"})
+                result = await self.result_from_torrents([torrent.get("name") for torrent in res["results"]])
+                self.store_result(query, local_file, result)
+            except Exception as e:
+                error = str(e)
+                if "429" in str(e):
+                    logger.error(f"{log_prefix}Rate limit exceeded while checking.")
                 else:
-                    release_info = guessit(torrents[0].get("name"))
-                    if "release_group" in release_info \
-                            and release_info["release_group"].casefold() in map(str.casefold, self.banned_groups):
-                        logger.info(
-                            f"{log_prefix} Trumpable: Banned Group: {release_info['release_group']}"
-                        )
-                        filepath = os.path.dirname(episode["episodeFile"]["path"])
-                        if filepath:
-                            self.sonarr_trump_writer.writerow({'file': filepath, 'reason': 'Banned group'})
-                    else:
-                        logger.info(
-                            f"{log_prefix}already exists"
-                        )
-        except Exception as e:
-            if "429" in str(e):
-                logger.error(f"{log_prefix}Rate limit exceeded while checking.")
-            else:
-                logger.error(f"{log_prefix}Error: {str(e)}")
-                self.sonarr_not_found_file.write(f"Error: {str(e)}\n")
+                    logger.error(f"{log_prefix}Error: {str(e)}")
+                    self.write_not_found("sonarr", f"Error: {str(e)}")
+        else:
+            logger.debug(f"{"\t" if indented else ""}[{self.__class__.__name__}] cache hit: {query}")
+        if result is not None:
+            self.report_result("sonarr", result, log_prefix, os.path.dirname(season.path))
+        self.record_result("sonarr", season, resolution, tracker_source, result or {"status": "error", "error": error},
+                           time.monotonic() - started, cache_hit)
 
         logger.debug(
             f"\t[{self.__class__.__name__}] search url: {search_url}"
         )
+        return result is not None
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger("customLogger")
+
+
+class RateLimiter:
+    """
+    Async token bucket. Each request takes one token, tokens refill at requests_per_minute
+    and up to `burst` can be saved up. Waiting is done with asyncio.sleep so other
+    trackers and items keep running.
+    """
+
+    # pause used after a 429 when the tracker doesn't say how long to wait
+    DEFAULT_BACKOFF = 60.0
+
+    def __init__(self, requests_per_minute=None, burst=1):
+        self.requests_per_minute = requests_per_minute
+        self.burst = max(1, int(burst or 1))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        if self.requests_per_minute:
+            rate = self.requests_per_minute / 60.0
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    async def acquire(self):
+        # lock keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                if not self.requests_per_minute:
+                    return
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * 60.0 / self.requests_per_minute)
+
+    def block_for(self, seconds):
+        until = time.monotonic() + max(0.0, seconds)
+        if until > self.blocked_until:
+            self.blocked_until = until
+            # don't let saved up tokens fire a burst right after the pause
+            self.tokens = 0.0
+
+    def update_from_response(self, status, headers):
+        # slow down when the tracker says so. Retry-After wins, then X-RateLimit-* headers
+        retry_after = parse_retry_after(headers.get("Retry-After"))
+        if retry_after is not None:
+            logger.debug(f"Rate limiter: Retry-After {retry_after:.0f}s")
+            self.block_for(retry_after)
+            return
+
+        remaining = _to_float(headers.get("X-RateLimit-Remaining"))
+        if remaining is not None:
+            if remaining <= 0:
+                reset = parse_reset(headers.get("X-RateLimit-Reset"))
+                self.block_for(reset if reset is not None else self.DEFAULT_BACKOFF)
+            else:
+                self.tokens = min(self.tokens, remaining)
+
+        if status == 429 and self.blocked_until <= time.monotonic():
+            self.block_for(self.DEFAULT_BACKOFF)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_retry_after(value):
+    # Retry-After is either delay seconds or an http date
+    if value is None:
+        return None
+    seconds = _to_float(value)
+    if seconds is not None:
+        return max(0.0, seconds)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def parse_reset(value):
+    # X-RateLimit-Reset is seconds until reset or an epoch timestamp depending on the site
+    reset = _to_float(value)
+    if reset is None:
+        return None
+    if reset > 1_000_000_000:
+        reset -= time.time()
+    return max(0.0, reset)
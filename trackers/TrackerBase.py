@@ -1,13 +1,63 @@
+import asyncio
+import contextlib
 import csv
+import json
 import logging
 import os
+import time
+import urllib.parse
 import AppConfig
+import httppool
+import parsecache
+import profiling
+from scheduler import defer
+from trackers.RateLimiter import RateLimiter
 
 logger = logging.getLogger("customLogger")
 
+def normalize_url(url):
+    # same query in any parameter order maps to the same key
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+
+
 class TrackerBase:
+    # times a 429 answer is retried after the rate limiter pause before the search fails
+    RATE_LIMIT_RETRIES = 3
+    # a catalog sync with fewer titles than this share of the last snapshot is treated as failed
+    CATALOG_MIN_RATIO = 0.5
+
     def __init__(self):
+        self.api_key = ""
+        self.app_configs = None
         self.banned_groups = []
+        # casefolded copy of banned_groups for O(1) lookups. always set through set_banned_groups
+        self._banned_index = frozenset()
+        # in flight blacklist fetch shared by every search that needs it
+        self._banned_refresh = None
+        # failed fetches wait before trying again. doubles on every failure
+        self._banned_retry_at = 0.0
+        self._banned_backoff = 60.0
+        # hours a blacklist stored on disk is used before asking the tracker again
+        self.banned_groups_ttl_hours = 24
+        # max requests in flight to this tracker. None means only the global concurrency applies
+        self.max_concurrent = None
+        self._request_slots = None
+        self.rate_limiter = RateLimiter()
+        # searches in flight by normalized url. identical queries share one request.
+        # dropped when it finishes so no response bodies are kept
+        self._in_flight = {}
+        self.coalesced = 0
+        # connection pool settings and the tracker's own session. set up by main
+        self.http_settings = {}
+        self.session = None
+        self.pool_stats = None
+        # catalog mode answers searches from a local snapshot of the whole tracker instead of per item requests
+        self.catalog_enabled = False
+        self.catalog_ttl_hours = 24
+        self.catalog = None
+        self._catalog_lock = asyncio.Lock()
         self.radarr_not_found_file = None
         self.radarr_trump_file = None
         self.radarr_trump_writer = None
@@ -16,6 +66,25 @@ class TrackerBase:
         self.sonarr_trump_writer = None
         pass
 
+    def load_tracker_config(self, app_configs: AppConfig):
+        trkr = next((sub for sub in app_configs.tracker_configs if sub["name"] == self.__class__.__name__), None)
+        if trkr:
+            self.api_key = trkr.get("api_key")
+            # base url override. e.g. a mirror or a local mock server for benchmarks
+            if trkr.get("url"):
+                self.URL = trkr["url"].rstrip("/")
+            self.max_concurrent = trkr.get("max_concurrent", app_configs.tracker_concurrency)
+            # fall back to the old global sleep timer when no rate is configured for the tracker
+            requests_per_minute = trkr.get("requests_per_minute")
+            if requests_per_minute is None and app_configs.sleep_timer:
+                requests_per_minute = 60 / app_configs.sleep_timer
+            self.rate_limiter = RateLimiter(requests_per_minute, trkr.get("burst", 1))
+            self.banned_groups_ttl_hours = trkr.get("banned_groups_ttl_hours", 24)
+            self.catalog_enabled = trkr.get("catalog", False)
+            self.catalog_ttl_hours = trkr.get("catalog_ttl_hours", 24)
+            self.http_settings = httppool.http_settings(app_configs.http, trkr.get("http"))
+        return trkr
+
     def setup_log_files(self, app_configs: AppConfig):
         output_path = app_configs.log_files.get("output_path")
         if output_path is not None:
@@ -23,27 +92,370 @@ class TrackerBase:
         else:
             log_path = os.path.join(os.path.expanduser(self.__class__.__name__))
         os.makedirs(log_path, exist_ok=True)
-        csv_headers = ['file', 'reason']
+        # a resumed scan adds to the files of the interrupted one
+        self.output_mode = "a" if app_configs.resume else "w"
+        # files are opened on the first write or by finish_output
+        self.output_paths = {}
 
         if app_configs.radarr.get("enabled"):
-            out_category = os.path.join(log_path, app_configs.log_files['not_found_radarr'])
-            out_trump = os.path.join(log_path, app_configs.log_files['trump_radarr'])
-            self.radarr_not_found_file = open(out_category, "w", encoding="utf-8", buffering=1)
-            self.radarr_trump_file = open(out_trump, 'w', newline='', encoding='utf-8', buffering=1)
-            self.radarr_trump_writer = csv.DictWriter(self.radarr_trump_file, fieldnames=csv_headers, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            self.radarr_trump_writer.writeheader()
+            self.output_paths[("radarr", "not_found")] = os.path.join(log_path, app_configs.log_files['not_found_radarr'])
+            self.output_paths[("radarr", "trump")] = os.path.join(log_path, app_configs.log_files['trump_radarr'])
 
         if app_configs.sonarr.get("enabled"):
-            out_category = os.path.join(log_path, app_configs.log_files['not_found_sonarr'])
-            out_trump = os.path.join(log_path, app_configs.log_files['trump_sonarr'])
-            self.sonarr_not_found_file = open(out_category, "w", encoding="utf-8", buffering=1)
-            self.sonarr_trump_file = open(out_trump, 'w', newline='', encoding='utf-8', buffering=1)
-            self.sonarr_trump_writer = csv.DictWriter(self.sonarr_trump_file, fieldnames=csv_headers, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            self.sonarr_trump_writer.writeheader()
+            self.output_paths[("sonarr", "not_found")] = os.path.join(log_path, app_configs.log_files['not_found_sonarr'])
+            self.output_paths[("sonarr", "trump")] = os.path.join(log_path, app_configs.log_files['trump_sonarr'])
+
+    def open_output(self, arr, kind):
+        # runs on the output writer thread
+        out_file = getattr(self, f"{arr}_{kind}_file")
+        if out_file is not None:
+            return out_file
+        path = self.output_paths[(arr, kind)]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if kind == "trump":
+            out_file = open(path, self.output_mode, newline='', encoding='utf-8')
+            trump_writer = csv.DictWriter(out_file, fieldnames=['file', 'reason'], delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            if out_file.tell() == 0:
+                trump_writer.writeheader()
+            setattr(self, f"{arr}_trump_writer", trump_writer)
+        else:
+            out_file = open(path, self.output_mode, encoding="utf-8")
+        setattr(self, f"{arr}_{kind}_file", out_file)
+        writer = self.app_configs.output_writer if self.app_configs is not None else None
+        if writer is not None:
+            writer.add_file(out_file)
+        return out_file
+
+    def finish_output(self):
+        # files nothing was written to still replace the previous run's, like when they were opened up front
+        for arr, kind in self.output_paths:
+            self.write_output(self.open_output, arr, kind)
+
+    def request_slot(self):
+        # limits requests in flight to this tracker when max_concurrent is set
+        if not self.max_concurrent:
+            return contextlib.nullcontext()
+        if self._request_slots is None:
+            self._request_slots = asyncio.Semaphore(self.max_concurrent)
+        return self._request_slots
+
+    async def fetch_json(self, session, url, method="GET", coalesce=True, **kwargs):
+        # json body of a request. identical requests made while one is in flight share its response
+        if not coalesce:
+            status, headers, res = await self.request_json(session, url, method, **kwargs)
+            return res
+        key = (method, normalize_url(url), repr(kwargs.get("json")), repr(kwargs.get("data")))
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.request_json(session, url, method, **kwargs))
+            future.add_done_callback(lambda done: self._request_done(key, done))
+            self._in_flight[key] = future
+        else:
+            self.coalesced += 1
+            if self.app_configs is not None and self.app_configs.run_metrics is not None:
+                self.app_configs.run_metrics.inc("tracker_requests_coalesced_total", {"tracker": self.__class__.__name__})
+        # shielded so a cancelled caller doesn't cancel the request for the others waiting on it
+        status, headers, res = await asyncio.shield(future)
+        return res
+
+    def _request_done(self, key, future):
+        self._in_flight.pop(key, None)
+        # every caller may have been cancelled. fetch the error so asyncio doesn't log it as never retrieved
+        if not future.cancelled():
+            future.exception()
+
+    async def request_json(self, session, url, method="GET", **kwargs):
+        # rate limited request. returns status, response headers and the json body (None for 304 Not Modified)
+        for attempt in range(self.RATE_LIMIT_RETRIES + 1):
+            queued = time.perf_counter()
+            async with self.request_slot():
+                await self.rate_limiter.acquire()
+                profiling.record("rate limit wait", time.perf_counter() - queued)
+                # the tracker's own pool when main opened one
+                with profiling.phase("tracker http", cpu=False):
+                    async with (self.session or session).request(method, url, **kwargs) as response:
+                        self.rate_limiter.update_from_response(response.status, response.headers)
+                        # a 429 blocked the rate limiter for Retry-After. wait it out with a new token and try again
+                        if response.status == 429 and attempt < self.RATE_LIMIT_RETRIES:
+                            logger.debug(f"[{self.__class__.__name__}] 429 rate limited. retrying {url}")
+                            continue
+                        response.raise_for_status()
+                        if response.status == 304:
+                            return response.status, response.headers, None
+                        return response.status, response.headers, await response.json()
+
+    def supports_catalog(self) -> bool:
+        return type(self).fetch_catalog is not TrackerBase.fetch_catalog
+
+    async def fetch_catalog(self, session) -> dict:
+        # page through the trackers whole movie/tv catalog. returns an index of
+        # "<category>:<id>" -> list of [resolution, type, season, torrent name]
+        raise NotImplementedError
+
+    def get_catalog_path(self):
+        return os.path.join(self.app_configs.get_cache_path(), f"{self.__class__.__name__}-catalog.json")
+
+    async def ensure_catalog(self, session):
+        # load the snapshot from disk or sync it once. concurrent searches wait on the same sync
+        if self.catalog is not None:
+            return self.catalog
+        async with self._catalog_lock:
+            if self.catalog is not None:
+                return self.catalog
+            catalog_path = self.get_catalog_path()
+            previous = 0
+            if os.path.exists(catalog_path):
+                try:
+                    with open(catalog_path, "r", encoding="utf-8") as f:
+                        snapshot = json.load(f)
+                    previous = len(snapshot["index"])
+                    if previous and time.time() - snapshot.get("synced", 0) < self.catalog_ttl_hours * 60 * 60:
+                        self.catalog = snapshot["index"]
+                        logger.info(f"[{self.__class__.__name__}] Loaded catalog snapshot: {len(self.catalog)} titles")
+                        return self.catalog
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error(f"[{self.__class__.__name__}] Error reading catalog snapshot: {e}")
+
+            logger.info(f"[{self.__class__.__name__}] Syncing catalog... ")
+            started = time.time()
+            index = await self.fetch_catalog(session)
+            logger.info(f"{len(index)} titles in {time.time() - started:.0f}s")
+            # an empty or much smaller index is a broken sync, not a tracker that lost its torrents.
+            # raise so prepare_tracker falls back to the search api and the last snapshot isn't replaced
+            if not index or len(index) < previous * self.CATALOG_MIN_RATIO:
+                raise ValueError(f"catalog sync returned {len(index)} titles, last snapshot had {previous}")
+            os.makedirs(os.path.dirname(catalog_path), exist_ok=True)
+            with open(f"{catalog_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump({"synced": time.time(), "index": index}, f)
+            os.replace(f"{catalog_path}.tmp", catalog_path)
+            self.catalog = index
+            return self.catalog
+
+    def catalog_lookup(self, category, media_id, resolutions=None, video_type=None, season_number=None):
+        # same filters the search api applies, run against the local snapshot
+        resolutions = [res for res in (resolutions or []) if res not in (0, "0")]
+        names = []
+        for resolution, torrent_type, season, name in self.catalog.get(f"{category}:{media_id}", []):
+            if resolutions and resolution is not None and resolution not in resolutions:
+                continue
+            if video_type and torrent_type is not None and torrent_type != video_type:
+                continue
+            if season_number and season != season_number:
+                continue
+            names.append(name)
+        return names
+
+    # cached search results. keyed by tracker, normalized query and local file identity
+    def cached_result(self, query, file):
+        result_cache = self.app_configs.result_cache
+        if result_cache is None:
+            return None
+        with profiling.phase("result cache"):
+            result = result_cache.get(self.__class__.__name__, query, file)
+        # the banned list may have changed since the search. judge the cached torrent's group against the current one
+        if result is not None and result["status"] in ("exists", "trump"):
+            result["status"] = "trump" if self.is_banned(result["group"]) else "exists"
+        return result
+
+    def store_result(self, query, file, result):
+        result_cache = self.app_configs.result_cache
+        if result_cache is not None:
+            with profiling.phase("result cache"):
+                result_cache.put(self.__class__.__name__, query, file, result)
+
+    async def parse_release(self, name):
+        # guessit fields for a file/torrent name, memoized across runs when the parse cache is set up.
+        # parsed in the parse pool when there is one
+        parse_cache = self.app_configs.parse_cache if self.app_configs else None
+        if parse_cache is None:
+            return parsecache.parse_name(name)
+        return await parse_cache.parse_async(name)
+
+    async def result_from_torrents(self, torrent_names):
+        # first search result decides. trumpable if it's from a banned group
+        if len(torrent_names) == 0:
+            return {"status": "not_found", "torrent": None, "group": None}
+        release_info = await self.parse_release(torrent_names[0])
+        release_group = release_info.get("release_group")
+        if self.is_banned(release_group):
+            return {"status": "trump", "torrent": torrent_names[0], "group": release_group}
+        return {"status": "exists", "torrent": torrent_names[0], "group": release_group}
+
+    def report_result(self, arr, result, log_prefix, file):
+        if result["status"] == "not_found":
+            if file:
+                logger.info(
+                    f"{log_prefix}not found"
+                )
+                self.write_not_found(arr, file)
+            else:
+                logger.info(
+                    f"{log_prefix}not found. (No media file)"
+                )
+        elif result["status"] == "trump":
+            logger.info(
+                f"{log_prefix} Trumpable: Banned Group: {result['group']}"
+            )
+            if file:
+                self.write_trump(arr, file, 'Banned group')
+        else:
+            logger.info(
+                f"{log_prefix}already exists"
+            )
+
+    def record_result(self, arr, item, resolution, video_type, result, latency=None, cache_hit=False):
+        if self.app_configs is None:
+            return
+        # failed searches stay unfinished so --resume tries them again
+        if self.app_configs.checkpoint is not None and result["status"] != "error":
+            defer(self.app_configs.checkpoint.mark, arr, item, self)
+        # one structured record per item and tracker when the jsonl results output is on
+        sink = self.app_configs.results_sink
+        if sink is None:
+            return
+        defer(sink.add, {
+            "type": "result",
+            "arr": arr,
+            "instance": item.instance,
+            "tracker": self.__class__.__name__,
+            "arr_id": item.arr_id,
+            "title": item.title,
+            "tmdb_id": item.tmdb_id,
+            "imdb_id": item.imdb_id,
+            "tvdb_id": getattr(item, "tvdb_id", None),
+            "season": getattr(item, "season_number", None),
+            "file": item.path,
+            "release_group": item.release_group or None,
+            "resolution": str(resolution) if resolution is not None else None,
+            "type_searched": str(video_type) if video_type is not None else None,
+            "status": result["status"],
+            "torrent": result.get("torrent"),
+            "torrent_group": result.get("group"),
+            "error": result.get("error"),
+            "latency_ms": round(latency * 1000, 1) if latency is not None else None,
+            "cache_hit": cache_hit,
+        })
+
+    def write_output(self, func, *args):
+        # hand the write to the background writer once logging is set up
+        writer = self.app_configs.output_writer if self.app_configs is not None else None
+        if writer is None:
+            func(*args)
+        else:
+            writer.write(func, *args)
+
+    # result writes are deferred so concurrent checks keep the output files in item order
+    def write_not_found(self, arr, line):
+        defer(self.write_output, self._write_not_found, arr, f"{line}\n")
+
+    def write_trump(self, arr, file, reason):
+        defer(self.write_output, self._write_trump, arr, {'file': file, 'reason': reason})
+
+    def _write_not_found(self, arr, text):
+        self.open_output(arr, "not_found").write(text)
+
+    def _write_trump(self, arr, row):
+        self.open_output(arr, "trump")
+        getattr(self, f"{arr}_trump_writer").writerow(row)
+
+    def set_banned_groups(self, banned_groups):
+        self.banned_groups = list(banned_groups)
+        self._banned_index = frozenset(group.casefold() for group in self.banned_groups)
+
+    def is_banned(self, release_group) -> bool:
+        return isinstance(release_group, str) and release_group.casefold() in self._banned_index
+
+    def get_banned_groups_url(self):
+        # trackers with a blacklist api return its url. None means the tracker has no api for it
+        return None
+
+    def parse_banned_groups(self, res):
+        # group names from the blacklist api response
+        raise NotImplementedError
+
+    def get_banned_groups_path(self):
+        return os.path.join(self.app_configs.get_cache_path(), f"{self.__class__.__name__}-banned_groups.json")
+
+    def load_banned_groups_snapshot(self):
+        try:
+            with open(self.get_banned_groups_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_banned_groups_snapshot(self, snapshot):
+        snapshot_path = self.get_banned_groups_path()
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        with open(f"{snapshot_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(f"{snapshot_path}.tmp", snapshot_path)
+
+    async def fetch_banned_groups(self, session, snapshot=None):
+        # conditional request with the stored ETag/Last-Modified so an unchanged list only costs a 304
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        if snapshot and snapshot.get("etag"):
+            headers["If-None-Match"] = snapshot["etag"]
+        if snapshot and snapshot.get("last_modified"):
+            headers["If-Modified-Since"] = snapshot["last_modified"]
+        status, response_headers, res = await self.request_json(session, self.get_banned_groups_url(), headers=headers)
+        if status == 304 and snapshot:
+            logger.debug(f"[{self.__class__.__name__}] Banned groups not modified")
+            return {**snapshot, "fetched": time.time()}
+        return {
+            "fetched": time.time(),
+            "etag": response_headers.get("ETag"),
+            "last_modified": response_headers.get("Last-Modified"),
+            "groups": self.parse_banned_groups(res),
+        }
+
+    async def refresh_banned_groups(self, session):
+        # fetch the blacklist once. concurrent callers await the same fetch, failures back off
+        if self._banned_index or time.monotonic() < self._banned_retry_at:
+            return
+        if self._banned_refresh is None:
+            self._banned_refresh = asyncio.ensure_future(self._refresh_banned_groups(session))
+        await asyncio.shield(self._banned_refresh)
+
+    async def reload_banned_groups(self, session):
+        # --serve runs for days. fetches again once the stored blacklist is older than the ttl,
+        # the current list stays in use until then
+        if self._banned_refresh is None:
+            self._banned_refresh = asyncio.ensure_future(self._refresh_banned_groups(session))
+        await asyncio.shield(self._banned_refresh)
+
+    async def _refresh_banned_groups(self, session):
+        if self.get_banned_groups_url() is None:
+            # no api. configured list is all there is, don't try again this run
+            self._banned_retry_at = float("inf")
+            self._banned_refresh = None
+            return
+
+        snapshot = self.load_banned_groups_snapshot() if self.app_configs else None
+        try:
+            if snapshot and snapshot.get("groups") and time.time() - snapshot.get("fetched", 0) < self.banned_groups_ttl_hours * 60 * 60:
+                self.set_banned_groups(snapshot["groups"])
+                return
+            fresh = await self.fetch_banned_groups(session, snapshot)
+            if len(fresh["groups"]) == 0:
+                raise ValueError("empty blacklist")
+            self.set_banned_groups(fresh["groups"])
+            if self.app_configs:
+                self.save_banned_groups_snapshot(fresh)
+        except Exception as e:
+            if snapshot and snapshot.get("groups"):
+                # tracker unreachable. a stale list beats skipping the banned checks
+                logger.warning(f"\n[{self.__class__.__name__}] Error fetching banned groups failed: {str(e)}. Using cached list.")
+                self.set_banned_groups(snapshot["groups"])
+            else:
+                logger.error(f"\n[{self.__class__.__name__}] Error fetching banned groups failed: {str(e)}. Retrying in {self._banned_backoff:.0f}s")
+                self._banned_retry_at = time.monotonic() + self._banned_backoff
+                self._banned_backoff = min(self._banned_backoff * 2, 60 * 60)
+        finally:
+            self._banned_refresh = None
 
     def is_group_banned(self, release_group, log_prefix="") -> bool:
         # check if banned groups still empty and display warning.
-        if len(self.banned_groups) == 0:
+        if not self._banned_index:
             logger.error(
                 f"{log_prefix}ERROR: Banned groups missing. Checks will be skipped."
             )
@@ -52,7 +464,7 @@ class TrackerBase:
                 f"\nERROR: Release group missing. Checks will be skipped."
             )
         else:
-            if release_group.casefold() in map(str.casefold, self.banned_groups):
+            if self.is_banned(release_group):
                 logger.info(
                     f"{log_prefix}Skipped. local file banned group: {release_group}"
                 )
@@ -1,6 +1,9 @@
+import codecs
 import importlib
+import json
 import logging
 import AppConfig
+import profiling
 
 logger = logging.getLogger("customLogger")
 
@@ -51,6 +54,7 @@ def sites_from_config(search_list, app_configs: AppConfig):
             print(f"Error: {e}")
     return sites
 
+@profiling.timed("classification")
 def get_video_type(source, modifier):
     if not isinstance(source, list):
         source = (source or '').lower()
@@ -100,4 +104,58 @@ def get_video_type(source, modifier):
     elif "bluray" in modifier and "remux" not in modifier:
         return 'ENCODE'
     else:
-        return 'OTHER'
\ No newline at end of file
+        return 'OTHER'
+
+async def iter_json_array(response, chunk_size=64 * 1024):
+    """
+    Incrementally parses a top level json array from an aiohttp response.
+
+    Args:
+        response: aiohttp response with a json array body.
+        chunk_size (int): bytes read from the connection at a time.
+
+    Yields:
+        Each array element as soon as its bytes have arrived.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(response.charset or "utf-8")()
+    buffer = ""
+    started = False
+    finished = False
+    chunks = response.content.iter_chunked(chunk_size).__aiter__()
+    while not finished:
+        with profiling.phase("library download", cpu=False):
+            chunk = await anext(chunks, None)
+        if chunk is None:
+            break
+        # elements completed by this chunk. yielded outside the timed block
+        elements = []
+        with profiling.phase("json decode"):
+            buffer += text_decoder.decode(chunk)
+            pos = 0
+            while True:
+                # skip whitespace and separators between elements
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos >= len(buffer):
+                    break
+                if not started:
+                    if buffer[pos] != "[":
+                        raise ValueError(f"Expected json array, got: {buffer[pos:pos + 20]}")
+                    started = True
+                    pos += 1
+                    continue
+                if buffer[pos] == "]":
+                    finished = True
+                    break
+                try:
+                    element, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # element not complete yet. wait for more bytes
+                    break
+                elements.append(element)
+            buffer = buffer[pos:]
+        for element in elements:
+            yield element
+    if not finished and buffer.strip():
+        raise ValueError("Unexpected end of json array")
@@ -0,0 +1,162 @@
+import asyncio
+import hmac
+import logging
+
+import aiohttp
+from aiohttp import web
+
+import radarr
+import scheduler
+import sonarr
+from AppConfig import AppConfig
+
+logger = logging.getLogger("customLogger")
+
+# radarr and sonarr send eventType "Download" for both On Import and On Upgrade
+IMPORT_EVENTS = ("Download",)
+
+
+class WebhookServer:
+    """
+    --serve mode. Takes Radarr/Sonarr On Import/On Upgrade webhooks on POST /<instance name>,
+    loads the movie or series again from that instance and checks it on the trackers. Checks
+    are queued and run by --concurrency workers so the tracker rate limits still apply.
+    Sonarr sends one webhook per episode file so imports of the same item within delay_seconds
+    are checked once. Unlike a scan, items aren't claimed across instances: every import is a
+    new file and the server runs for days, so a claim would skip later imports for good.
+    """
+
+    def __init__(self, app_configs: AppConfig, sessions):
+        self.app_configs = app_configs
+        # arr -> session
+        self.sessions = sessions
+        self.settings = app_configs.serve
+        self.queue = asyncio.Queue()
+        # (arr, instance name, arr id) -> season numbers imported. waiting for the delay or a worker
+        self.pending = {}
+        self.instances = {}
+        if app_configs.radarr["enabled"]:
+            self.instances.update({instance["name"]: ("radarr", instance) for instance in app_configs.radarr_instances if instance["enabled"]})
+        if app_configs.sonarr["enabled"]:
+            self.instances.update({instance["name"]: ("sonarr", instance) for instance in app_configs.sonarr_instances if instance["enabled"]})
+        self._runner = None
+        self._tasks = []
+
+    def _authorized(self, request):
+        # radarr/sonarr webhook username/password. only the password is checked
+        if not self.settings["password"]:
+            return True
+        try:
+            auth = aiohttp.BasicAuth.decode(request.headers.get("Authorization", ""))
+        except ValueError:
+            return False
+        return hmac.compare_digest(auth.password.encode(), self.settings["password"].encode())
+
+    async def _handle_webhook(self, request):
+        if not self._authorized(request):
+            return web.json_response({"error": "unauthorized"}, status=401, headers={"WWW-Authenticate": 'Basic realm="exists-check"'})
+        name = request.match_info["instance"]
+        if name not in self.instances:
+            return web.json_response({"error": f"unknown instance {name}"}, status=404)
+        arr, instance = self.instances[name]
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.json_response({"error": "invalid json"}, status=400)
+
+        event = payload.get("eventType")
+        if self.app_configs.run_metrics is not None:
+            self.app_configs.run_metrics.inc("webhooks_total", {"instance": name, "event": event})
+        if event == "Test":
+            logger.info(f"Webhook: test from {name}")
+            return web.json_response({"status": "ok"})
+        if event not in IMPORT_EVENTS:
+            logger.debug(f"Webhook: ignored {event} from {name}")
+            return web.json_response({"status": "ignored"})
+
+        if arr == "radarr":
+            arr_id = (payload.get("movie") or {}).get("id")
+            seasons = set()
+        else:
+            arr_id = (payload.get("series") or {}).get("id")
+            seasons = {episode.get("seasonNumber") for episode in payload.get("episodes") or []}
+        if arr_id is None:
+            return web.json_response({"error": f"no {"movie" if arr == "radarr" else "series"} id"}, status=400)
+        self.enqueue(arr, name, arr_id, seasons)
+        return web.json_response({"status": "queued"}, status=202)
+
+    def enqueue(self, arr, name, arr_id, seasons):
+        key = (arr, name, arr_id)
+        if key in self.pending:
+            self.pending[key] |= seasons
+            return
+        self.pending[key] = set(seasons)
+        asyncio.get_running_loop().call_later(self.settings["delay_seconds"], self.queue.put_nowait, key)
+
+    async def _worker(self):
+        while True:
+            key = await self.queue.get()
+            arr, name, arr_id = key
+            seasons = self.pending.pop(key, set())
+            try:
+                # concurrent checks keep their output together like a scan does
+                if arr == "radarr":
+                    await scheduler.run_buffered(self.check_movie(self.instances[name][1], arr_id))
+                else:
+                    await scheduler.run_buffered(self.check_show(self.instances[name][1], arr_id, seasons))
+            except Exception as e:
+                logger.error(f"Webhook: check of {name} id {arr_id} failed: {e}")
+            finally:
+                # write the results now instead of waiting for a full batch
+                if self.app_configs.results_sink is not None:
+                    self.app_configs.results_sink.flush()
+                self.queue.task_done()
+
+    async def check_movie(self, instance, movie_id):
+        session = self.sessions["radarr"]
+        movie = await radarr.get_movie(session, instance, movie_id)
+        logger.info(f"Webhook: Checking {movie.title}: ")
+        if not movie.has_file:
+            logger.info("SKIPPED. missing local file")
+            return
+        if await radarr.process_movie(session, movie, self.app_configs.trackers) and self.app_configs.scan_state is not None:
+            self.app_configs.scan_state.mark_movie(movie)
+        if self.app_configs.run_metrics is not None:
+            self.app_configs.run_metrics.inc("items_total", {"arr": "radarr"})
+
+    async def check_show(self, instance, series_id, seasons):
+        session = self.sessions["sonarr"]
+        show = await sonarr.get_show(session, instance, series_id)
+        # only the seasons episodes were imported into
+        if seasons:
+            show["seasons"] = [season for season in show.get("seasons", []) if season["seasonNumber"] in seasons]
+        logger.info(f"Webhook: Checking {show["title"]}:")
+        await sonarr.process_show(session, show, self.app_configs.trackers, self.app_configs, claim=False)
+        if self.app_configs.run_metrics is not None:
+            self.app_configs.run_metrics.inc("items_total", {"arr": "sonarr"})
+
+    async def _refresh_banned_groups(self):
+        # blacklists change while the server runs. each tracker fetches again once its ttl is up
+        while True:
+            await asyncio.sleep(60 * 60)
+            for tracker in self.app_configs.trackers:
+                await tracker.reload_banned_groups(tracker.session)
+
+    async def serve(self):
+        # runs until cancelled
+        app = web.Application()
+        app.router.add_post("/{instance}", self._handle_webhook)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.settings["host"], self.settings["port"]).start()
+            logger.info(f"Webhook: listening on http://{self.settings["host"]}:{self.settings["port"]}/<instance> for {", ".join(self.instances)}")
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(max(1, self.app_configs.concurrency))]
+            self._tasks.append(asyncio.create_task(self._refresh_banned_groups()))
+            await asyncio.gather(*self._tasks)
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self._runner.cleanup()
+            self._runner = None